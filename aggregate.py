@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from decimal import Decimal
+
+
+# Single-pass monthly aggregation. Every split of every account feeding a
+# column is visited exactly once: its reporting period number comes from the
+# ledger's period calendar and its value is added, in integer cents, to each
+# column the account belongs to. Cents are only converted back to Decimal at
+# the end, so totals match GnuCash exactly, and with the exponent adding up the
+# split Decimals would have given (the smallest split exponent, or a plain 0
+# for a period without splits), so they print the way they always did. A
+# split finer than a cent, e.g. 12345/1000, is added as a Decimal number of
+# cents instead, so its total is still exact.
+#
+# Books loaded from a database (see booksql.py) do the grouping themselves
+# and only hand back the per-period totals.
+
+SUM = 'sum'
+# Number of other splits in each transaction, e.g. members paying dues
+COUNT = 'count'
+
+
+def to_cents(value):
+    cents = value * 100
+    if cents != cents.to_integral_value():
+        return cents
+    return int(cents)
+
+
+def aggregate(ledger, months, columns):
+    # months: ascending reporting period end dates, as yielded by report_days()
+    # columns: (name, kind, accounts, sign) tuples; each account's subtree feeds the column
+    if not months:
+        return []
+
+    calendar = ledger.calendar
+    positions = dict((calendar.index(month), position) for position, month in enumerate(months))
+
+    targets = {}
+    column_accounts = [set() for column in columns]
+    for index, (name, kind, accounts, sign) in enumerate(columns):
+        for account in accounts:
+            for subaccount, children, splits in account.walk():
+                indexes = targets.setdefault(subaccount.guid, (subaccount, []))[1]
+                if index not in indexes:
+                    indexes.append(index)
+                column_accounts[index].add(subaccount.guid)
+
+    if hasattr(ledger.book, 'aggregate'):
+        periods = [(ledger.period_start(month), month) for month in months]
+        cents, counts, exponents = ledger.book.aggregate(periods, [sorted(guids) for guids in column_accounts])
+        totals = [counts[index] if kind == COUNT else cents[index]
+                  for index, (name, kind, accounts, sign) in enumerate(columns)]
+        return _rows(months, columns, totals, exponents)
+
+    totals = [[0] * len(months) for column in columns]
+    exponents = [[None] * len(months) for column in columns]
+
+    scanned = 0
+    for account, indexes in targets.values():
+        scanned += len(account.splits)
+        for split in account.splits:
+            position = positions.get(ledger.period_index(split))
+            if position is None:
+                continue
+
+            cents = None
+            for index in indexes:
+                if columns[index][1] == COUNT:
+                    totals[index][position] += len(split.transaction.splits) - 1
+                else:
+                    if cents is None:
+                        cents = to_cents(split.value)
+                        exponent = split.value.as_tuple()[2]
+                    totals[index][position] += cents
+                    # None until the first split; the sum starts from a plain 0
+                    previous = exponents[index][position]
+                    exponents[index][position] = min(exponent, 0 if previous is None else previous)
+
+    ledger.scanned += scanned
+
+    return _rows(months, columns, totals, exponents)
+
+
+def _rows(months, columns, totals, exponents):
+    rows = [{} for month in months]
+    for index, (name, kind, accounts, sign) in enumerate(columns):
+        for period, total in enumerate(totals[index]):
+            exponent = exponents[index][period]
+            if kind == COUNT or exponent is None:
+                rows[period][name] = total * sign
+            else:
+                rows[period][name] = Decimal(total).scaleb(-2).quantize(Decimal(1).scaleb(exponent)) * sign
+
+    return rows
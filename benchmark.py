@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import sys
+import json
+import getopt
+import shutil
+import tempfile
+import timeit
+from datetime import date, datetime
+from dateutil.relativedelta import relativedelta
+import bookcache
+import compactbook
+import drafts
+import emails
+import forecast
+import members
+import outputs
+import scenarios
+import synthbook
+from membership import Membership
+from classify import AccountClassifier
+from member import load_members, get_aging
+
+
+# Times forecast.py, members.py, emails.py and scenarios.py stage by stage
+# (parse, per-month aggregation, projection, CSV output) and end to end,
+# against a synthetic book from synthbook.py or a book given on the command
+# line. Each timing is the best of -n runs. Stages that read the ledger get a
+# freshly indexed one for every run, so nothing memoized by an earlier run is
+# timed. Everything is written to a scratch directory, including the parsed
+# book cache.
+#
+#     benchmark.py -m 200 -y 5 -t 100 -j results.json
+
+DEFAULT_REPEAT = 3
+DEFAULT_MONTHS = 12
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "c:j:m:n:s:t:y:")
+    except getopt.GetoptError:
+        print("argument error")
+        sys.exit(2)
+
+    members_count = synthbook.DEFAULT_MEMBERS
+    years = synthbook.DEFAULT_YEARS
+    transactions = synthbook.DEFAULT_TRANSACTIONS
+    seed = 0
+    months = DEFAULT_MONTHS
+    repeat = DEFAULT_REPEAT
+    results_filename = None
+
+    for opt, arg in opts:
+        if opt == '-c':
+            months = int(arg)
+        elif opt == '-j':
+            results_filename = arg
+        elif opt == '-m':
+            members_count = int(arg)
+        elif opt == '-n':
+            repeat = int(arg)
+        elif opt == '-s':
+            seed = int(arg)
+        elif opt == '-t':
+            transactions = int(arg)
+        elif opt == '-y':
+            years = int(arg)
+
+    scratch = tempfile.mkdtemp(prefix='benchmark')
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(scratch, 'cache')
+    try:
+        if args:
+            filename = os.path.abspath(args[0])
+        else:
+            filename = os.path.join(scratch, 'synthetic.gnucash')
+            print("Generating", members_count, "members,", years, "years,", transactions, "transactions per month")
+            synthbook.write_book(filename, members_count, years, transactions, seed)
+
+        results = run(filename, scratch, months, repeat)
+    finally:
+        if cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = cache_home
+        shutil.rmtree(scratch)
+
+    for entry_point, stage, seconds in results:
+        print("{:<10} {:<12} {:>10.4f} s".format(entry_point, stage, seconds))
+
+    if results_filename:
+        with open(results_filename, 'w') as results_file:
+            json.dump({
+                'book': args[0] if args else None,
+                'members': None if args else members_count,
+                'years': None if args else years,
+                'transactions': None if args else transactions,
+                'months': months,
+                'repeat': repeat,
+                'python': sys.version.split()[0],
+                'timings': [{'entry_point': entry_point, 'stage': stage, 'seconds': seconds}
+                            for entry_point, stage, seconds in results],
+            }, results_file, indent=2)
+
+
+def run(filename, scratch, months_context, repeat):
+    results = []
+
+    def timed(entry_point, stage, function, setup=None):
+        # setup() runs untimed before each run and returns function's arguments
+        value = []
+        seconds = []
+        for number in range(repeat):
+            arguments = setup() if setup is not None else ()
+            started = timeit.default_timer()
+            value.append(function(*arguments))
+            seconds.append(timeit.default_timer() - started)
+        results.append((entry_point, stage, min(seconds)))
+        return value[-1]
+
+    today = forecast.report_today()
+    start = today - relativedelta(months=+months_context)
+    end = today + relativedelta(months=+months_context)
+    months = list(forecast.report_days(start, today))
+
+    # forecast.py
+    book = timed('forecast', 'parse', lambda: bookcache.load(filename, forecast.REPORT_ACCOUNTS, use_cache=False))
+    bookcache.load(filename, forecast.REPORT_ACCOUNTS)
+    timed('forecast', 'cached load', lambda: bookcache.load(filename, forecast.REPORT_ACCOUNTS))
+
+    def index():
+        ledger = compactbook.open_ledger(book, forecast.MONTH_START_DAY)
+        return ledger, Membership(ledger), AccountClassifier(ledger, forecast.DEFAULT_ACCOUNT_RULES)
+
+    ledger, membership, classifier = timed('forecast', 'index', index)
+
+    def aggregate(ledger, membership, classifier):
+        totals = forecast.get_monthly_aggregates(classifier, months)
+        for month, month_totals in zip(months, totals):
+            month_totals[forecast.NEW_MEMBERS] = len(membership.new_members(month))
+            month_totals[forecast.LOST_MEMBERS] = len(membership.lost_members(month))
+            month_totals[forecast.CAPITAL] = (forecast.get_assets_on_date(ledger, month) +
+                                              forecast.get_liability_on_date(ledger, month))
+        return totals
+
+    timed('forecast', 'aggregate', aggregate, index)
+
+    # The projection as forecast.py makes it: the models are fed the history, then project each month
+    history = forecast.get_forecast(ledger, membership, classifier, today, months_context, 0, log=forecast.quiet)
+    fieldnames = forecast.get_fieldnames()
+
+    def project(ledger, membership, classifier):
+        projections = forecast.get_fitted_projections(classifier, history, forecast.DEFAULT_PROJECTION_MODELS,
+                                                      list(forecast.DEFAULT_PROJECTION_MODELS) + ['rent'])
+        return history + list(forecast.iter_projection_rows(classifier, history[-1], projections,
+                                                            list(forecast.report_days(today, end)), fieldnames,
+                                                            forecast.quiet))
+
+    rows = timed('forecast', 'project', project, index)
+    timed('forecast', 'csv', lambda: outputs.CsvOutput(os.path.join(scratch, 'forecast.csv')).write(
+        fieldnames, rows, datetime.now()))
+    timed('forecast', 'total', lambda: quietly(scratch, forecast.main, ['-c', str(months_context), filename]))
+
+    # members.py
+    member_book = timed('members', 'parse', lambda: bookcache.load(filename, ["Active Members"], use_cache=False))
+    active_members = timed('members', 'members', lambda: load_members(member_book))
+    timed('members', 'aging', lambda: get_aging(compactbook.open_ledger(member_book, forecast.MONTH_START_DAY),
+                                                active_members, months))
+    timed('members', 'total', lambda: quietly(scratch, members.main, ['-g', str(months_context), filename]))
+
+    # emails.py
+    now = date.today()
+    late_members = [member for member in active_members
+                    if member.effective_balance() < 0 and member.email() is not None]
+    reminders = timed('emails', 'render', lambda: [emails.dues_reminder(member, now) for member in late_members])
+
+    timed('emails', 'outbox', lambda: drafts.write_outbox(os.path.join(scratch, 'outbox.mbox'), reminders))
+    timed('emails', 'total', lambda: quietly(scratch, emails.main,
+                                             ['-o', os.path.join(scratch, 'reminders.mbox'), filename]))
+
+    # scenarios.py
+    scenarios_filename = os.path.join(scratch, 'scenarios.json')
+    with open(scenarios_filename, 'w') as scenarios_file:
+        json.dump({'growth': {'member_growth': 0.02}, 'rent': {'rent_increase': 0.1}}, scenarios_file)
+    timed('scenarios', 'total', lambda: quietly(scratch, scenarios.main,
+                                                ['-c', str(months_context), filename, scenarios_filename]))
+
+    return results
+
+
+def quietly(directory, function, argv):
+    # Entry points write their reports to the working directory and chat on stdout
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    os.chdir(directory)
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        function(argv)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import sys
+import gzip
+import hashlib
+import pickle
+from array import array
+from io import BytesIO
+import flatbook
+import bookstream
+import booksql
+import outputs
+
+
+# Parsed books are cached on disk as flattened columns. A cache entry is only
+# used when the size, modification time and content hash of the book all
+# match, and the hash is taken over the exact bytes that get parsed, so a book
+# saved while a report is running can never be cached under the wrong key.
+
+CACHE_VERSION = 2
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'financial_forecast')
+
+
+def cache_path(filename, account_names=None):
+    key = os.path.abspath(filename)
+    if account_names is not None:
+        key += '\0' + '\0'.join(sorted(account_names))
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir(), key + '.pickle')
+
+
+def load(filename, account_names=None, use_cache=True):
+    # SQLite books are queried in place, the database already is an index
+    if booksql.is_sqlite(filename):
+        return booksql.from_filename(filename, account_names)
+
+    data, key, path = _read(filename, account_names)
+
+    if use_cache:
+        columns = read_cache(path, key)
+        if columns is not None:
+            return flatbook.unflatten(columns)
+
+    book = parse(data, account_names)
+
+    if use_cache:
+        try:
+            write_cache(path, key, flatbook.flatten(book))
+        except OverflowError:
+            # A split value too precise for the compact columns; just don't cache it
+            pass
+
+    return book
+
+
+def load_columns(filename, account_names=None, use_cache=True):
+    # Like load(), but returns the flattened columns without building the object graph.
+    # Raises OverflowError for books too precise for the columns, which are never cached
+    if booksql.is_sqlite(filename):
+        return flatbook.flatten(booksql.from_filename(filename, account_names))
+
+    data, key, path = _read(filename, account_names)
+
+    if use_cache:
+        columns = read_cache(path, key)
+        if columns is not None:
+            return columns
+
+    columns = flatbook.flatten(parse(data, account_names))
+    if use_cache:
+        write_cache(path, key, columns)
+    return columns
+
+
+def _read(filename, account_names):
+    with open(filename, 'rb') as book_file:
+        stat = os.fstat(book_file.fileno())
+        data = book_file.read()
+
+    key = (CACHE_VERSION, sys.version_info[0], stat.st_size, stat.st_mtime, hashlib.sha1(data).hexdigest(),
+           sorted(account_names) if account_names is not None else None)
+    return data, key, cache_path(filename, account_names)
+
+
+def parse(data, account_names=None):
+    # Books are normally gzip-compressed, but GnuCash can also save them as plain XML
+    if data[:2] == b'\x1f\x8b':
+        return bookstream.parse(gzip.GzipFile(fileobj=BytesIO(data)), account_names)
+    return bookstream.parse(BytesIO(data), account_names)
+
+
+def read_cache(path, key):
+    try:
+        with open(path, 'rb') as cache_file:
+            if pickle.load(cache_file) != key:
+                return None
+            return _unpack(pickle.load(cache_file))
+    except Exception:
+        # Missing, stale or unreadable caches are simply rebuilt
+        return None
+
+
+def write_cache(path, key, columns):
+    directory = os.path.dirname(path)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        def write_columns(temp_path):
+            with open(temp_path, 'wb') as cache_file:
+                pickle.dump(key, cache_file, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(_pack(columns), cache_file, pickle.HIGHEST_PROTOCOL)
+
+        outputs.replace_file(path, write_columns)
+    except (IOError, OSError, pickle.PicklingError):
+        print("Warning: could not write book cache", path)
+
+
+# Python 2 pickles arrays as lists of ints, and loading those costs many times
+# the memory of the arrays themselves, so arrays are cached as their bytes
+
+def _pack(columns):
+    return dict((name, (values.typecode, _array_bytes(values)) if isinstance(values, array) else values)
+                for name, values in columns.items())
+
+
+def _unpack(columns):
+    unpacked = {}
+    for name, values in columns.items():
+        if isinstance(values, tuple):
+            typecode, data = values
+            values = array(typecode)
+            if hasattr(values, 'frombytes'):
+                values.frombytes(data)
+            else:
+                values.fromstring(data)
+        unpacked[name] = values
+    return unpacked
+
+
+def _array_bytes(values):
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import time
+import sqlite3
+import calendar
+import threading
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime
+from decimal import Decimal
+import flatbook
+from periods import PeriodCalendar
+
+
+# GnuCash books saved with the SQLite backend. Only the account tree is read
+# up front; the database itself is the index. SqlLedger answers Ledger's
+# questions with queries (period totals and balances are summed by SQLite,
+# only the splits asked for are made into objects), and SqlBook.aggregate()
+# hands aggregate.py the monthly totals grouped by column and reporting
+# period, using GnuCash's own indexes on splits.account_guid, splits.tx_guid
+# and transactions.post_date.
+#
+# Reports that walk every split, e.g. Member balances or flattening the book
+# for the cache, load the transactions touching the requested account
+# subtrees into the same objects bookstream.py builds the first time an
+# account's splits or the book's transactions are asked for.
+#
+# GnuCash stores post dates in UTC, while the XML loader and the reports work
+# in local wall-clock time; dates are converted to local time when read and
+# period bounds back to UTC when queried. GnuCash 2.x wrote them as
+# YYYYMMDDHHMMSS, later versions as YYYY-MM-DD HH:MM:SS; both are read.
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y%m%d%H%M%S']
+
+# Transactions touching a requested account subtree, see bookstream.py
+KEPT_TRANSACTIONS = 't.guid IN (SELECT tx_guid FROM splits WHERE account_guid IN (SELECT guid FROM kept_accounts))'
+
+
+class SqlBook(object):
+    def __init__(self, root_account, accounts, kept_guids, filename, date_format):
+        self.root_account = root_account
+        self.accounts = accounts
+        self.kept_guids = kept_guids
+        self.filename = filename
+        self.date_format = date_format
+        self._transactions = None
+        self._splits = None
+        self._local = threading.local()
+
+    def walk(self):
+        return self.root_account.walk()
+
+    def find_account(self, name):
+        return self.root_account.find_account(name)
+
+    @property
+    def transactions(self):
+        self._load()
+        return self._transactions
+
+    def account_splits(self, account):
+        self._load()
+        return self._splits.get(account.guid, [])
+
+    def _load(self):
+        if self._transactions is not None:
+            return
+
+        transactions, splits = self.read_transactions('''
+            SELECT t.guid, t.post_date, t.description, s.account_guid, s.value_num, s.value_denom, 1
+            FROM transactions t
+            JOIN splits s ON s.tx_guid = t.guid
+            WHERE {}
+            ORDER BY t.post_date, t.guid, s.rowid'''.format(KEPT_TRANSACTIONS))
+
+        self._splits = {}
+        for split in splits:
+            self._splits.setdefault(split.account.guid, []).append(split)
+        self._transactions = transactions
+
+    def read_transactions(self, query, parameters=()):
+        # query yields (guid, post_date, description, account_guid, value_num,
+        # value_denom, wanted) rows, transaction by transaction. Returns the
+        # transactions, whole, and the splits that were wanted
+        transactions = []
+        wanted_splits = []
+        transaction = None
+        for guid, post_date, description, account_guid, value_num, value_denom, wanted in self.execute(
+                query, parameters):
+            if transaction is None or transaction.guid != guid:
+                transaction = flatbook.Transaction(guid=guid, date=self.local_date(post_date),
+                                                   description=description)
+                transactions.append(transaction)
+
+            split = flatbook.Split(value=Decimal(value_num) / Decimal(value_denom),
+                                   account=self.accounts[account_guid], transaction=transaction)
+            transaction.splits.append(split)
+            if wanted:
+                wanted_splits.append(split)
+
+        return transactions, wanted_splits
+
+    def latest_transaction(self):
+        # (date, GUID) of the latest transaction, see incremental.py
+        latest = self.execute('''
+            SELECT t.post_date, t.guid FROM transactions t
+            WHERE {}
+            ORDER BY t.post_date DESC, t.guid DESC LIMIT 1'''.format(KEPT_TRANSACTIONS)).fetchone()
+        if latest is None:
+            return None
+        return self.local_date(latest[0]), latest[1]
+
+    def connection(self):
+        # One connection per thread, with the kept accounts in a temporary table
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename)
+            connection.execute('CREATE TEMP TABLE kept_accounts (guid TEXT PRIMARY KEY)')
+            connection.executemany('INSERT INTO kept_accounts VALUES (?)', [(guid,) for guid in self.kept_guids])
+            connection.execute('CREATE TEMP TABLE query_accounts (guid TEXT PRIMARY KEY)')
+            self._local.connection = connection
+        return connection
+
+    def execute(self, query, parameters=()):
+        return self.connection().execute(query, parameters)
+
+    def set_query_accounts(self, guids):
+        connection = self.connection()
+        connection.execute('DELETE FROM query_accounts')
+        connection.executemany('INSERT OR IGNORE INTO query_accounts VALUES (?)', [(guid,) for guid in guids])
+
+    def local_date(self, text):
+        utc = datetime.strptime(text, self.date_format)
+        return datetime.fromtimestamp(calendar.timegm(utc.timetuple()))
+
+    def utc_text(self, date):
+        return datetime.utcfromtimestamp(time.mktime(date.replace(tzinfo=None).timetuple())).strftime(
+            self.date_format)
+
+    def aggregate(self, periods, columns):
+        # periods: (start, end) pairs, each period covers (start, end]
+        # columns: the account guids feeding each column, subaccounts included
+        # Returns each column's per-period split value total in cents (a
+        # Decimal if any split is finer than a cent), count of other splits in
+        # the same transactions, and the smallest exponent of the split values
+        # as Decimals (None for a period without splits)
+        connection = self.connection()
+        bounds = [(self.utc_text(start), self.utc_text(end)) for start, end in periods]
+        try:
+            connection.execute('CREATE TEMP TABLE periods (period INTEGER PRIMARY KEY, start TEXT, end TEXT)')
+            connection.executemany('INSERT INTO periods VALUES (?, ?, ?)', [
+                (period, start, end) for period, (start, end) in enumerate(bounds)])
+
+            connection.execute('CREATE TEMP TABLE column_accounts (column_index INTEGER, account_guid TEXT)')
+            connection.executemany('INSERT INTO column_accounts VALUES (?, ?)', [
+                (index, guid) for index, guids in enumerate(columns) for guid in guids])
+
+            cents = [[0] * len(periods) for column in columns]
+            counts = [[0] * len(periods) for column in columns]
+            exponents = [[None] * len(periods) for column in columns]
+            for index, period, total, count, exponent, inexact in connection.execute('''
+                    SELECT c.column_index, p.period,
+                           SUM(s.value_num * 100 / s.value_denom),
+                           SUM((SELECT COUNT(*) FROM splits o WHERE o.tx_guid = s.tx_guid) - 1),
+                           MIN({}),
+                           SUM((s.value_num * 100) % s.value_denom != 0)
+                    FROM column_accounts c
+                    JOIN splits s ON s.account_guid = c.account_guid
+                    JOIN transactions t ON t.guid = s.tx_guid
+                    JOIN periods p ON t.post_date > p.start AND t.post_date <= p.end
+                    GROUP BY c.column_index, p.period'''.format(EXPONENT)).fetchall():
+                if inexact:
+                    # Finer than cents; add the Decimals up as they are, as a Decimal number of cents
+                    total = 0
+                    exponent = 0
+                    for value_num, value_denom in connection.execute('''
+                            SELECT s.value_num, s.value_denom
+                            FROM column_accounts c
+                            JOIN splits s ON s.account_guid = c.account_guid
+                            JOIN transactions t ON t.guid = s.tx_guid
+                            WHERE c.column_index = ? AND t.post_date > ? AND t.post_date <= ?''',
+                            (index,) + bounds[period]):
+                        value = Decimal(value_num) / Decimal(value_denom)
+                        total += value * 100
+                        exponent = min(exponent, value.as_tuple()[2])
+                cents[index][period] = total
+                counts[index][period] = count
+                exponents[index][period] = exponent
+
+            return cents, counts, exponents
+        finally:
+            connection.execute('DROP TABLE IF EXISTS temp.periods')
+            connection.execute('DROP TABLE IF EXISTS temp.column_accounts')
+
+
+# The exponent of a split value as the Decimal value_num / value_denom, for whole cents
+EXPONENT = '''CASE WHEN s.value_num % s.value_denom = 0 THEN 0
+                   WHEN (s.value_num * 10) % s.value_denom = 0 THEN -1
+                   ELSE -2 END'''
+
+
+class SqlAccount(object):
+    __slots__ = ('book', 'guid', 'name', 'actype', 'description', 'parent', 'children')
+
+    def __init__(self, book, guid, name, actype, description=None):
+        self.book = book
+        self.guid = guid
+        self.name = name
+        self.actype = actype
+        self.description = description
+        self.parent = None
+        self.children = []
+
+    def __repr__(self):
+        return "<Account '{}' {}...>".format(self.name, self.guid[:10])
+
+    @property
+    def splits(self):
+        return SqlSplits(self)
+
+    def walk(self):
+        accounts = deque([self])
+        while accounts:
+            account = accounts.popleft()
+            children = list(account.children)
+            yield (account, children, account.splits)
+            accounts.extend(children)
+
+    def find_account(self, name):
+        for account, children, splits in self.walk():
+            if account.name == name:
+                return account
+
+    def get_all_splits(self):
+        split_list = []
+        for account, children, splits in self.walk():
+            split_list.extend(splits)
+        return sorted(split_list, key=lambda split: split.transaction.date)
+
+
+class SqlSplits(object):
+    # An account's splits, only loaded from the database when they are looked at
+    __slots__ = ('account',)
+
+    def __init__(self, account):
+        self.account = account
+
+    def __len__(self):
+        return len(self.account.book.account_splits(self.account))
+
+    def __getitem__(self, index):
+        return self.account.book.account_splits(self.account)[index]
+
+    def __iter__(self):
+        return iter(self.account.book.account_splits(self.account))
+
+
+class SqlLedger(object):
+    # Ledger's read API over a SqlBook
+
+    def __init__(self, book, month_start_day):
+        self.book = book
+        self.month_start_day = month_start_day
+        self.calendar = PeriodCalendar(month_start_day)
+        self.scanned = 0
+
+        self._accounts = {}
+        self._paths = {}
+        self._subtrees = {}
+        self._timelines = {}
+
+    def _account_guids(self, account, subtree):
+        if not subtree:
+            return [account.guid]
+        if account.guid not in self._subtrees:
+            self._subtrees[account.guid] = [subaccount.guid for subaccount, children, splits in account.walk()]
+        return self._subtrees[account.guid]
+
+    def account(self, name):
+        if name not in self._accounts:
+            self._accounts[name] = self.book.find_account(name)
+        return self._accounts[name]
+
+    def path(self, account):
+        key = account.guid
+        if key not in self._paths:
+            if account.parent is None:
+                self._paths[key] = account.name
+            else:
+                self._paths[key] = self.path(account.parent) + ":" + account.name
+        return self._paths[key]
+
+    def date(self, split):
+        return split.transaction.date
+
+    def period_index(self, split):
+        return self.calendar.index(self.date(split))
+
+    def period_end(self, date):
+        return self.calendar.end(self.calendar.index(date))
+
+    def period_start(self, month_end):
+        return self.calendar.end(self.calendar.index(month_end) - 1)
+
+    def splits(self, account, month_end, subtree=True):
+        self.book.set_query_accounts(self._account_guids(account, subtree))
+        transactions, splits = self.book.read_transactions('''
+            SELECT t.guid, t.post_date, t.description, s.account_guid, s.value_num, s.value_denom,
+                   s.account_guid IN (SELECT guid FROM query_accounts)
+            FROM transactions t
+            JOIN splits s ON s.tx_guid = t.guid
+            WHERE t.guid IN (SELECT tx_guid FROM splits WHERE account_guid IN (SELECT guid FROM query_accounts))
+              AND t.post_date > ? AND t.post_date <= ?
+            ORDER BY t.post_date, t.guid, s.rowid''', (self.book.utc_text(self.period_start(month_end)),
+                                                       self.book.utc_text(month_end)))
+        self.scanned += len(splits)
+        return splits
+
+    def total(self, account, month_end, subtree=True):
+        self.book.set_query_accounts(self._account_guids(account, subtree))
+        return self._sum('t.post_date > ? AND t.post_date <= ?', (self.book.utc_text(self.period_start(month_end)),
+                                                                  self.book.utc_text(month_end)))
+
+    def balance(self, account, date, subtree=True):
+        dates, totals = self._timeline(account, subtree)
+        position = bisect_right(dates, self.book.utc_text(date))
+        if position == 0:
+            return 0
+        if totals is None:
+            # Finer than cents, add the Decimals up
+            self.book.set_query_accounts(self._account_guids(account, subtree))
+            return self._sum('t.post_date <= ?', (dates[position - 1],))
+        cents, exponent = totals[position - 1]
+        return Decimal(cents).scaleb(-2).quantize(Decimal(1).scaleb(exponent))
+
+    def _timeline(self, account, subtree):
+        # The account's post dates, as stored, with the running total in cents
+        # and smallest exponent up to each; the totals are None if any split is
+        # finer than cents
+        key = (account.guid, subtree)
+        if key not in self._timelines:
+            self.book.set_query_accounts(self._account_guids(account, subtree))
+            dates = []
+            totals = []
+            cents = 0
+            exponent = 0
+            inexact = False
+            for post_date, date_cents, date_exponent, date_inexact, count in self.book.execute('''
+                    SELECT t.post_date, SUM(s.value_num * 100 / s.value_denom), MIN({}),
+                           SUM((s.value_num * 100) % s.value_denom != 0), COUNT(*)
+                    FROM splits s
+                    JOIN transactions t ON t.guid = s.tx_guid
+                    WHERE s.account_guid IN (SELECT guid FROM query_accounts)
+                    GROUP BY t.post_date
+                    ORDER BY t.post_date'''.format(EXPONENT)):
+                cents += date_cents
+                exponent = min(exponent, date_exponent)
+                inexact = inexact or date_inexact
+                self.scanned += count
+                dates.append(post_date)
+                totals.append((cents, exponent))
+
+            self._timelines[key] = (dates, None if inexact else totals)
+        return self._timelines[key]
+
+    def _sum(self, conditions, parameters):
+        # The query accounts' splits matching conditions, added up the way
+        # Ledger adds their Decimals: a plain 0 without splits, otherwise at
+        # the smallest exponent
+        conditions = 's.account_guid IN (SELECT guid FROM query_accounts) AND ' + conditions
+        count, cents, exponent, inexact = self.book.execute('''
+            SELECT COUNT(*), SUM(s.value_num * 100 / s.value_denom), MIN({}),
+                   SUM((s.value_num * 100) % s.value_denom != 0)
+            FROM splits s
+            JOIN transactions t ON t.guid = s.tx_guid
+            WHERE {}'''.format(EXPONENT, conditions), parameters).fetchone()
+        self.scanned += count
+
+        if not count:
+            return 0
+        if inexact:
+            total = 0
+            for value_num, value_denom in self.book.execute('''
+                    SELECT s.value_num, s.value_denom FROM splits s
+                    JOIN transactions t ON t.guid = s.tx_guid
+                    WHERE {}'''.format(conditions), parameters):
+                total += Decimal(value_num) / Decimal(value_denom)
+            return total
+        return Decimal(cents).scaleb(-2).quantize(Decimal(1).scaleb(exponent))
+
+    def period_summary(self, month_end):
+        # Like Ledger.period_summary, with each account's value total in cents
+        # and the sum of its value numerators in place of the checksum
+        summary = []
+        for guid, count, cents, numerators in self.book.execute('''
+                SELECT s.account_guid, COUNT(*), SUM(s.value_num * 100 / s.value_denom), SUM(s.value_num)
+                FROM splits s
+                JOIN transactions t ON t.guid = s.tx_guid
+                WHERE t.post_date > ? AND t.post_date <= ? AND {}
+                GROUP BY s.account_guid'''.format(KEPT_TRANSACTIONS),
+                (self.book.utc_text(self.period_start(month_end)), self.book.utc_text(month_end))):
+            summary.append((self.path(self.book.accounts[guid]), count, cents, numerators))
+        return sorted(summary)
+
+
+def is_sqlite(filename):
+    with open(filename, 'rb') as book_file:
+        return book_file.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def from_filename(filename, account_names=None):
+    connection = sqlite3.connect(filename)
+    try:
+        root_guid = connection.execute('SELECT root_account_guid FROM books').fetchone()[0]
+        rows = connection.execute(
+            'SELECT guid, name, account_type, description, parent_guid FROM accounts').fetchall()
+        first_date = connection.execute('SELECT post_date FROM transactions LIMIT 1').fetchone()
+    finally:
+        connection.close()
+
+    book = SqlBook(None, {}, [], filename, _date_format(first_date[0]) if first_date else DATE_FORMATS[0])
+
+    parents = {}
+    for guid, name, actype, description, parent_guid in rows:
+        # GnuCash stores a missing description as an empty string
+        book.accounts[guid] = SqlAccount(book, guid=guid, name=name, actype=actype, description=description or None)
+        parents[guid] = parent_guid
+
+    for guid, account in book.accounts.items():
+        if parents[guid] is not None:
+            account.parent = book.accounts[parents[guid]]
+            account.parent.children.append(account)
+
+    book.root_account = book.accounts[root_guid]
+    if account_names is None:
+        kept_roots = [book.root_account]
+    else:
+        kept_roots = [account for account in (book.root_account.find_account(name) for name in account_names)
+                      if account is not None]
+    book.kept_guids = sorted(set(account.guid for kept_root in kept_roots
+                                 for account, children, splits in kept_root.walk()))
+
+    return book
+
+
+def _date_format(text):
+    for date_format in DATE_FORMATS:
+        try:
+            datetime.strptime(text, date_format)
+            return date_format
+        except ValueError:
+            pass
+    raise ValueError("Unknown GnuCash date format: {}".format(text))
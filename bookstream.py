@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from datetime import datetime
+from decimal import Decimal
+from xml.etree import ElementTree
+import flatbook
+
+
+# Streaming GnuCash XML loader. The book is read incrementally with iterparse
+# and every element is discarded as soon as it has been handled, so only the
+# account tree and the transactions touching the requested account subtrees
+# are ever held in memory.
+#
+# Transactions are kept whole: a kept dues payment still knows about all of
+# its member splits. Accounts outside the requested subtrees therefore only
+# see the splits of kept transactions and their balances are incomplete.
+
+GNC = '{http://www.gnucash.org/XML/gnc}'
+ACT = '{http://www.gnucash.org/XML/act}'
+TRN = '{http://www.gnucash.org/XML/trn}'
+SPLIT = '{http://www.gnucash.org/XML/split}'
+TS = '{http://www.gnucash.org/XML/ts}'
+
+
+def parse(fobj, account_names=None):
+    accounts = {}
+    parents = {}
+    root_account = None
+    kept_accounts = None
+    transactions = []
+    book_element = None
+    depth = 0
+
+    for event, element in ElementTree.iterparse(fobj, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if element.tag == GNC + 'book':
+                book_element = element
+            continue
+
+        depth -= 1
+        # Only direct children of gnc:book; scheduled transaction templates
+        # carry their own accounts and transactions further down
+        if depth != 2 or book_element is None:
+            continue
+
+        if element.tag == GNC + 'account':
+            parent_guid, account = _account_from_element(element)
+            accounts[account.guid] = account
+            parents[account.guid] = parent_guid
+            if account.actype == 'ROOT':
+                root_account = account
+
+        elif element.tag == GNC + 'transaction':
+            if kept_accounts is None:
+                # GnuCash writes every account before the first transaction
+                _link_accounts(accounts, parents)
+                kept_accounts = _kept_accounts(root_account, account_names)
+
+            transaction = _transaction_from_element(element, accounts, kept_accounts)
+            if transaction is not None:
+                transactions.append(transaction)
+
+        book_element.clear()
+
+    if kept_accounts is None:
+        _link_accounts(accounts, parents)
+
+    if root_account is None:
+        raise ValueError("File stream was not a valid GNU Cash v2 XML file")
+
+    return flatbook.Book(root_account=root_account, transactions=transactions)
+
+
+def _account_from_element(element):
+    description = element.find(ACT + 'description')
+    parent = element.find(ACT + 'parent')
+
+    account = flatbook.Account(guid=element.find(ACT + 'id').text,
+                               name=element.find(ACT + 'name').text,
+                               actype=element.find(ACT + 'type').text,
+                               description=description.text if description is not None else None)
+
+    return parent.text if parent is not None else None, account
+
+
+def _link_accounts(accounts, parents):
+    for guid, account in accounts.items():
+        parent_guid = parents[guid]
+        if parent_guid is not None and account.parent is None:
+            account.parent = accounts[parent_guid]
+            account.parent.children.append(account)
+
+
+def _kept_accounts(root_account, account_names):
+    if account_names is None or root_account is None:
+        return None
+
+    kept = set()
+    for name in account_names:
+        account = root_account.find_account(name)
+        if account is not None:
+            kept.update(subaccount.guid for subaccount, children, splits in account.walk())
+
+    return kept
+
+
+def _transaction_from_element(element, accounts, kept_accounts):
+    splits = []
+    keep = kept_accounts is None
+    for split_element in element.iterfind(TRN + 'splits/' + TRN + 'split'):
+        account_guid = split_element.find(SPLIT + 'account').text
+        splits.append((account_guid, split_element.find(SPLIT + 'value').text))
+        keep = keep or account_guid in kept_accounts
+
+    if not keep:
+        return None
+
+    transaction = flatbook.Transaction(guid=element.find(TRN + 'id').text,
+                                       date=_parse_date(element.find(TRN + 'date-posted/' + TS + 'date').text),
+                                       description=element.find(TRN + 'description').text)
+
+    for account_guid, value in splits:
+        account = accounts[account_guid]
+        split = flatbook.Split(value=_parse_number(value), account=account, transaction=transaction)
+        transaction.splits.append(split)
+        account.splits.append(split)
+
+    return transaction
+
+
+def _parse_date(text):
+    # Reports work in the book's local wall-clock time, so the offset is dropped
+    return datetime.strptime(text[:19], '%Y-%m-%d %H:%M:%S')
+
+
+def _parse_number(text):
+    num, denom = text.split('/')
+    return Decimal(num) / Decimal(denom)
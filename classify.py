@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import re
+import json
+import fnmatch
+
+
+# Expense and income accounts are sorted into categories once per book, so
+# the reports work with small integer ids instead of comparing names against
+# the exemption list on every call.
+#
+# Rules files are JSON objects mapping a category to a list of account names;
+# names containing shell wildcards (e.g. "Event *") are matched as patterns:
+#
+#     {"exempt": ["Anti-social 10-04", "Event *"], "rent": ["Rent"], "food": ["Groceries"]}
+
+EXEMPT = 0
+RENT = 1
+FOOD = 2
+EXPENSE = 3
+INCOME = 4
+
+CATEGORY_NAMES = {
+    'exempt': EXEMPT,
+    'rent': RENT,
+    'food': FOOD,
+}
+
+
+def load_rules(filename):
+    with open(filename) as rules_file:
+        rules = json.load(rules_file)
+
+    for category in rules:
+        if category not in CATEGORY_NAMES:
+            raise ValueError("Unknown account category in {}: {}".format(filename, category))
+
+    return rules
+
+
+class NameRule(object):
+    def __init__(self, names):
+        self.names = set(name for name in names if not _is_pattern(name))
+        patterns = [fnmatch.translate(name) for name in names if _is_pattern(name)]
+        self.pattern = re.compile('|'.join(patterns)) if patterns else None
+
+    def matches(self, name):
+        if name in self.names:
+            return True
+        return self.pattern is not None and self.pattern.match(name) is not None
+
+
+def _is_pattern(name):
+    return any(character in name for character in '*?[')
+
+
+class AccountClassifier(object):
+    def __init__(self, ledger, rules, expense_account="Expenses", income_account="Income"):
+        self.ledger = ledger
+
+        food = NameRule(rules.get('food', []))
+        rent = NameRule(rules.get('rent', []))
+        exempt = NameRule(rules.get('exempt', []))
+
+        self._accounts = dict((category, []) for category in (EXEMPT, RENT, FOOD, EXPENSE, INCOME))
+
+        for account in ledger.account(expense_account).children:
+            if food.matches(account.name):
+                category = FOOD
+            elif rent.matches(account.name):
+                category = RENT
+            elif exempt.matches(account.name):
+                category = EXEMPT
+            else:
+                category = EXPENSE
+            self._accounts[category].append(account)
+
+        for account in ledger.account(income_account).children:
+            self._accounts[EXEMPT if exempt.matches(account.name) else INCOME].append(account)
+
+    def accounts(self, *categories):
+        # The top level expense/income accounts in the given categories
+        accounts = []
+        for category in categories:
+            accounts.extend(self._accounts[category])
+        return accounts
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from array import array
+from binascii import hexlify, unhexlify
+from collections import deque
+from bisect import bisect_right
+from datetime import timedelta
+from decimal import Decimal
+import bookcache
+import booksql
+import consolidate
+import flatbook
+from flatbook import EPOCH, INT64
+from ledger import Ledger
+from periods import PeriodCalendar
+
+
+# Memory-compact books. The book stays in the flattened columns bookcache.py
+# caches (an account table plus parallel arrays of split transaction, account,
+# value and exponent) and each account gets date-sorted arrays of its split
+# numbers, dates, and running value totals. No Split or Transaction objects
+# are kept: accounts are small handles, and splits and transactions are views
+# made on demand when something asks for them, e.g. Member balances or
+# Membership, and dropped again afterwards.
+#
+# CompactLedger answers the same questions as Ledger from those arrays with
+# binary searches, and CompactBook.aggregate() gives aggregate.py per-period
+# totals straight from the running totals, like a SQLite book does.
+#
+# Amounts are kept as integers at the book's smallest decimal exponent. Totals
+# and balances are turned back into Decimals with the exponent adding the
+# original Decimals would have given, so reports print exactly as before.
+
+
+class CompactBook(object):
+    def __init__(self, columns):
+        self.columns = columns = dict(columns)
+
+        # Transaction GUIDs are packed into one string and the few distinct
+        # descriptions (mostly dues and donations) are shared
+        guids = columns['transaction_guid']
+        self._guids = _pack_guids(guids)
+        if self._guids is not None:
+            columns['transaction_guid'] = None
+        descriptions = {}
+        columns['transaction_description'] = [descriptions.setdefault(description, description)
+                                              for description in columns['transaction_description']]
+
+        parents = columns['account_parent']
+        self._ids = dict((guid, number) for number, guid in enumerate(columns['account_guid']))
+        self._children = [[] for parent in parents]
+        for number, parent in enumerate(parents):
+            if parent >= 0:
+                self._children[parent].append(number)
+        self._accounts = [CompactAccount(self, number) for number in range(len(parents))]
+        self.root_account = self._accounts[list(parents).index(-1)]
+
+        split_transactions = columns['split_transaction']
+        split_accounts = columns['split_account']
+        split_values = columns['split_value']
+        split_exponents = columns['split_exponent']
+        dates = columns['transaction_date']
+
+        # Splits are stored transaction by transaction
+        self._offsets = array('l', [0] * (len(dates) + 1))
+        for transaction in split_transactions:
+            self._offsets[transaction + 1] += 1
+        for number in range(len(dates)):
+            self._offsets[number + 1] += self._offsets[number]
+
+        self.exponent = min(min(split_exponents) if split_exponents else 0, 0)
+        self._values = array(INT64, (value * 10 ** (split_exponents[number] - self.exponent)
+                                     for number, value in enumerate(split_values)))
+
+        account_splits = [array('l') for parent in parents]
+        for number, account in enumerate(split_accounts):
+            account_splits[account].append(number)
+
+        self._splits = []
+        self._dates = []
+        self._totals = []
+        self._total_exponents = []
+        self._others = []
+        for splits in account_splits:
+            splits = sorted(splits, key=lambda split: dates[split_transactions[split]])
+
+            totals = array(INT64, [0])
+            total_exponents = array('b', [0])
+            others = array('l', [0])
+            for split in splits:
+                transaction = split_transactions[split]
+                totals.append(totals[-1] + self._values[split])
+                total_exponents.append(min(total_exponents[-1], split_exponents[split]))
+                others.append(others[-1] + self._offsets[transaction + 1] - self._offsets[transaction] - 1)
+
+            self._splits.append(array('l', splits))
+            self._dates.append(array(INT64, (dates[split_transactions[split]] for split in splits)))
+            self._totals.append(totals)
+            self._total_exponents.append(total_exponents)
+            self._others.append(others)
+
+    @property
+    def transactions(self):
+        return [CompactTransaction(self, number) for number in range(len(self.columns['transaction_date']))]
+
+    def transaction_guid(self, number):
+        if self._guids is None:
+            return self.columns['transaction_guid'][number]
+        guid = hexlify(self._guids[number * 16:number * 16 + 16])
+        return guid if isinstance(guid, str) else guid.decode('ascii')
+
+    def latest_transaction(self):
+        # (date, GUID) of the latest transaction, without making transaction views
+        dates = self.columns['transaction_date']
+        if not dates:
+            return None
+        latest = max(dates)
+        return (EPOCH + timedelta(seconds=latest),
+                max(self.transaction_guid(number) for number, date in enumerate(dates) if date == latest))
+
+    def walk(self):
+        return self.root_account.walk()
+
+    def find_account(self, name):
+        return self.root_account.find_account(name)
+
+    def account_range(self, account, start, end):
+        # Positions of the account's splits dated in (start, end], as seconds since EPOCH
+        dates = self._dates[account]
+        return bisect_right(dates, start), bisect_right(dates, end)
+
+    def decimal(self, value, exponent):
+        # value is at self.exponent; exponent is the one Decimal addition would give the total
+        return Decimal(value // 10 ** (exponent - self.exponent)).scaleb(exponent)
+
+    def aggregate(self, periods, columns):
+        # Same contract as booksql.SqlBook.aggregate
+        periods = [(_seconds(start), _seconds(end)) for start, end in periods]
+
+        exponents = self.columns['split_exponent']
+        cents = [[0] * len(periods) for column in columns]
+        counts = [[0] * len(periods) for column in columns]
+        total_exponents = [[None] * len(periods) for column in columns]
+        for index, guids in enumerate(columns):
+            for guid in guids:
+                account = self._ids[guid]
+                splits = self._splits[account]
+                totals = self._totals[account]
+                others = self._others[account]
+                for period, (start, end) in enumerate(periods):
+                    low, high = self.account_range(account, start, end)
+                    if low == high:
+                        continue
+                    cents[index][period] += self._cents(totals[high] - totals[low])
+                    counts[index][period] += others[high] - others[low]
+                    exponent = total_exponents[index][period]
+                    total_exponents[index][period] = min([0 if exponent is None else exponent] +
+                                                         [exponents[split] for split in splits[low:high]])
+
+        return cents, counts, total_exponents
+
+    def _cents(self, value):
+        # value is at self.exponent; a total finer than cents stays a Decimal number of cents
+        if self.exponent >= -2:
+            return value * 10 ** (self.exponent + 2)
+
+        factor = 10 ** (-2 - self.exponent)
+        if value % factor:
+            return Decimal(value).scaleb(self.exponent + 2)
+        return value // factor
+
+
+class CompactAccount(object):
+    __slots__ = ('book', 'id')
+
+    def __init__(self, book, number):
+        self.book = book
+        self.id = number
+
+    def __repr__(self):
+        return "<Account '{}' {}...>".format(self.name, self.guid[:10])
+
+    @property
+    def guid(self):
+        return self.book.columns['account_guid'][self.id]
+
+    @property
+    def name(self):
+        return self.book.columns['account_name'][self.id]
+
+    @property
+    def actype(self):
+        return self.book.columns['account_type'][self.id]
+
+    @property
+    def description(self):
+        return self.book.columns['account_description'][self.id]
+
+    @property
+    def parent(self):
+        parent = self.book.columns['account_parent'][self.id]
+        return self.book._accounts[parent] if parent >= 0 else None
+
+    @property
+    def children(self):
+        return [self.book._accounts[child] for child in self.book._children[self.id]]
+
+    @property
+    def splits(self):
+        return CompactSplits(self.book, self.book._splits[self.id])
+
+    def walk(self):
+        accounts = deque([self])
+        while accounts:
+            account = accounts.popleft()
+            children = account.children
+            yield (account, children, account.splits)
+            accounts.extend(children)
+
+    def find_account(self, name):
+        for account, children, splits in self.walk():
+            if account.name == name:
+                return account
+
+    def get_all_splits(self):
+        split_list = []
+        for account, children, splits in self.walk():
+            split_list.extend(splits)
+        return sorted(split_list, key=lambda split: split.transaction.date)
+
+
+class CompactSplits(object):
+    __slots__ = ('book', 'numbers')
+
+    def __init__(self, book, numbers):
+        self.book = book
+        self.numbers = numbers
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, index):
+        return CompactSplit(self.book, self.numbers[index])
+
+    def __iter__(self):
+        for number in self.numbers:
+            yield CompactSplit(self.book, number)
+
+
+class CompactTransaction(object):
+    __slots__ = ('book', 'id')
+
+    def __init__(self, book, number):
+        self.book = book
+        self.id = number
+
+    def __repr__(self):
+        return "<Transaction on {} '{}' {}...>".format(self.date, self.description, self.guid[:6])
+
+    @property
+    def guid(self):
+        return self.book.transaction_guid(self.id)
+
+    @property
+    def date(self):
+        return EPOCH + timedelta(seconds=self.book.columns['transaction_date'][self.id])
+
+    @property
+    def description(self):
+        return self.book.columns['transaction_description'][self.id]
+
+    @property
+    def splits(self):
+        return CompactSplits(self.book, range(self.book._offsets[self.id], self.book._offsets[self.id + 1]))
+
+
+class CompactSplit(object):
+    __slots__ = ('book', 'id')
+
+    def __init__(self, book, number):
+        self.book = book
+        self.id = number
+
+    def __repr__(self):
+        return "<Split {} '{}' {}>".format(self.transaction.date, self.transaction.description, self.value)
+
+    @property
+    def value(self):
+        columns = self.book.columns
+        return Decimal(columns['split_value'][self.id]).scaleb(columns['split_exponent'][self.id])
+
+    @property
+    def account(self):
+        return self.book._accounts[self.book.columns['split_account'][self.id]]
+
+    @property
+    def transaction(self):
+        return CompactTransaction(self.book, self.book.columns['split_transaction'][self.id])
+
+
+class CompactLedger(object):
+    # Ledger's read API over a CompactBook
+
+    def __init__(self, book, month_start_day):
+        self.book = book
+        self.month_start_day = month_start_day
+        self.calendar = PeriodCalendar(month_start_day)
+        self.scanned = 0
+
+        self._accounts = {}
+        self._paths = {}
+        self._subtrees = {}
+        self._periods = array('l', (self.calendar.index(EPOCH + timedelta(seconds=date))
+                                    for date in book.columns['transaction_date']))
+
+    def _account_ids(self, account, subtree):
+        if not subtree:
+            return [account.id]
+        if account.id not in self._subtrees:
+            self._subtrees[account.id] = [subaccount.id for subaccount, children, splits in account.walk()]
+        return self._subtrees[account.id]
+
+    def account(self, name):
+        if name not in self._accounts:
+            self._accounts[name] = self.book.find_account(name)
+        return self._accounts[name]
+
+    def path(self, account):
+        key = account.guid
+        if key not in self._paths:
+            if account.parent is None:
+                self._paths[key] = account.name
+            else:
+                self._paths[key] = self.path(account.parent) + ":" + account.name
+        return self._paths[key]
+
+    def date(self, split):
+        return split.transaction.date
+
+    def period_index(self, split):
+        return self._periods[self.book.columns['split_transaction'][split.id]]
+
+    def period_end(self, date):
+        return self.calendar.end(self.calendar.index(date))
+
+    def period_start(self, month_end):
+        return self.calendar.end(self.calendar.index(month_end) - 1)
+
+    def splits(self, account, month_end, subtree=True):
+        start = _seconds(self.period_start(month_end))
+        end = _seconds(month_end)
+
+        splits = []
+        for number in self._account_ids(account, subtree):
+            low, high = self.book.account_range(number, start, end)
+            splits.extend(CompactSplit(self.book, split) for split in self.book._splits[number][low:high])
+
+        self.scanned += len(splits)
+        return splits
+
+    def total(self, account, month_end, subtree=True):
+        start = _seconds(self.period_start(month_end))
+        end = _seconds(month_end)
+        exponents = self.book.columns['split_exponent']
+
+        value = 0
+        exponent = None
+        for number in self._account_ids(account, subtree):
+            low, high = self.book.account_range(number, start, end)
+            if low == high:
+                continue
+            totals = self.book._totals[number]
+            value += totals[high] - totals[low]
+            exponent = min([0 if exponent is None else exponent] +
+                           [exponents[split] for split in self.book._splits[number][low:high]])
+
+        if exponent is None:
+            return 0
+        return self.book.decimal(value, exponent)
+
+    def period_summary(self, month_end):
+        # Like Ledger.period_summary, with the accounts' value totals from the running totals
+        start = _seconds(self.period_start(month_end))
+        end = _seconds(month_end)
+
+        summary = []
+        for number, totals in enumerate(self.book._totals):
+            low, high = self.book.account_range(number, start, end)
+            if low < high:
+                summary.append((self.path(self.book._accounts[number]), high - low, totals[high] - totals[low]))
+        return sorted(summary)
+
+    def balance(self, account, date, subtree=True):
+        date = _seconds(date)
+
+        value = 0
+        exponent = None
+        for number in self._account_ids(account, subtree):
+            position = bisect_right(self.book._dates[number], date)
+            if position == 0:
+                continue
+            value += self.book._totals[number][position]
+            exponent = min(0 if exponent is None else exponent, self.book._total_exponents[number][position])
+
+        if exponent is None:
+            return 0
+        return self.book.decimal(value, exponent)
+
+
+def _pack_guids(guids):
+    # GnuCash GUIDs are 32 lowercase hex digits; books with anything else keep the list
+    if not all(len(guid) == 32 and guid == guid.lower() for guid in guids):
+        return None
+    try:
+        return b''.join(unhexlify(guid) for guid in guids)
+    except (TypeError, ValueError):
+        return None
+
+
+def _seconds(date):
+    delta = date.replace(tzinfo=None) - EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def load(filenames, account_names=None, jobs=None):
+    # Books with split values too precise for the compact columns are kept as
+    # object books; open_ledger() gives them a Ledger
+    if len(filenames) == 1:
+        try:
+            return CompactBook(bookcache.load_columns(filenames[0], account_names))
+        except OverflowError:
+            return bookcache.load(filenames[0], account_names)
+
+    book = consolidate.load(filenames, account_names, jobs)
+    try:
+        return CompactBook(flatbook.flatten(book))
+    except OverflowError:
+        return book
+
+
+def open_ledger(book, month_start_day):
+    if isinstance(book, CompactBook):
+        return CompactLedger(book, month_start_day)
+    if isinstance(book, booksql.SqlBook):
+        return booksql.SqlLedger(book, month_start_day)
+    return Ledger(book, month_start_day)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import multiprocessing
+from datetime import datetime
+import bookcache
+import flatbook
+
+
+# Books split per fiscal year, consolidated into one. The books are parsed in
+# parallel worker processes (through the book cache, so unchanged books cost
+# a cache read) and come back as flattened columns. Their accounts are then
+# merged by path and their transactions into one timeline:
+#
+# - a transaction that appears in more than one book (same GUID) is kept once,
+#   from the earliest book;
+# - the opening balance transactions of every book but the earliest are
+#   dropped, since they repeat balances the earlier books already add up to.
+#
+# Books are ordered by their first transaction, whatever order they are given in.
+
+OPENING_BALANCE_ACCOUNTS = ["Opening Balances", "Opening Balance"]
+
+
+def load(filenames, account_names=None, jobs=None):
+    if len(filenames) == 1:
+        return bookcache.load(filenames[0], account_names)
+
+    if jobs == 1:
+        books = [bookcache.load(filename, account_names) for filename in filenames]
+    else:
+        pool = multiprocessing.Pool(min(jobs or len(filenames), len(filenames)))
+        try:
+            columns = pool.map(_load_columns, [(filename, account_names) for filename in filenames])
+        finally:
+            pool.close()
+            pool.join()
+
+        books = []
+        for filename, book_columns in zip(filenames, columns):
+            if book_columns is None:
+                books.append(bookcache.load(filename, account_names))
+            else:
+                books.append(flatbook.unflatten(book_columns))
+
+    return merge(books)
+
+
+def _load_columns(item):
+    filename, account_names = item
+    try:
+        return bookcache.load_columns(filename, account_names)
+    except OverflowError:
+        # Too precise for the compact columns; the parent process loads it itself
+        return None
+
+
+def merge(books):
+    books = sorted(books, key=_first_date)
+
+    root_account = None
+    accounts = {}
+    transactions = []
+    seen = set()
+
+    for number, book in enumerate(books):
+        merged = {}
+        for account, children, splits in book.walk():
+            path = _path(account)
+            if path not in accounts:
+                parent = accounts[_path(account.parent)] if account.parent is not None else None
+                accounts[path] = flatbook.Account(guid=account.guid, name=account.name, actype=account.actype,
+                                                  description=account.description, parent=parent)
+                if parent is not None:
+                    parent.children.append(accounts[path])
+                else:
+                    root_account = accounts[path]
+            elif account.description:
+                # Later books have the more recent member details
+                accounts[path].description = account.description
+            merged[account.guid] = accounts[path]
+
+        for transaction in book.transactions:
+            if transaction.guid in seen:
+                continue
+            if number > 0 and _is_opening_balance(transaction):
+                continue
+            seen.add(transaction.guid)
+
+            for split in transaction.splits:
+                split.account = merged[split.account.guid]
+                split.account.splits.append(split)
+            transactions.append(transaction)
+
+    return flatbook.Book(root_account=root_account, transactions=transactions)
+
+
+def _first_date(book):
+    dates = [transaction.date.replace(tzinfo=None) for transaction in book.transactions]
+    return min(dates) if dates else datetime.max
+
+
+def _path(account):
+    names = []
+    while account.parent is not None:
+        names.append(account.name)
+        account = account.parent
+    return tuple(reversed(names))
+
+
+def _is_opening_balance(transaction):
+    return any(split.account.actype == 'EQUITY' and split.account.name in OPENING_BALANCE_ACCOUNTS
+               for split in transaction.splits)
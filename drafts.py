@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import time
+import socket
+import imaplib
+import mailbox
+import threading
+import outputs
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+# Draft delivery over a small pool of logged-in IMAP sessions. Worker
+# threads take one message at a time, render it, borrow a session and APPEND
+# it; sessions are reused for the whole run instead of logging in once per
+# message. Connection-level failures drop the session and are retried on a
+# fresh one with exponential backoff. When no session can be opened at all
+# the run gives up: the remaining messages fail straight away instead of each
+# backing off on its own.
+#
+# Servers are given as imaps://host:port or, e.g. for a local test server,
+# imap://host:port.
+#
+# Messages can also be rendered into a local outbox first and uploaded in a
+# separate step. Outboxes are Maildirs when the path is a directory (or ends
+# in a slash) and mbox files otherwise. Writing an mbox outbox replaces it,
+# so rendering twice never queues a reminder twice; a Maildir that still
+# holds messages is refused.
+
+DEFAULT_SERVER = 'imaps://imap.gmail.com:993'
+
+TRANSIENT_ERRORS = (imaplib.IMAP4.abort, socket.error)
+
+
+def connector(server, username, password, mailbox):
+    scheme, address = server.split('://', 1)
+    host, _, port = address.partition(':')
+    if scheme == 'imaps':
+        connection_class = imaplib.IMAP4_SSL
+        port = int(port) if port else 993
+    elif scheme == 'imap':
+        connection_class = imaplib.IMAP4
+        port = int(port) if port else 143
+    else:
+        raise ValueError("Unknown IMAP server scheme: {}".format(scheme))
+
+    def connect():
+        session = connection_class(host, port=port)
+        session.login(username, password)
+        session.select(mailbox)
+        return session
+
+    return connect
+
+
+class SessionPool(object):
+    def __init__(self, connect, size):
+        self.connect = connect
+        self.size = size
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._sessions = []
+        self._created = 0
+        self.error = None
+
+    def fail(self, error):
+        # Connecting failed for good; the first error is kept
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+    def acquire(self):
+        with self._lock:
+            create = self._idle.empty() and self._created < self.size
+            if create:
+                self._created += 1
+
+        if not create:
+            return self._idle.get()
+
+        try:
+            session = self.connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def release(self, session):
+        self._idle.put(session)
+
+    def discard(self, session):
+        with self._lock:
+            self._created -= 1
+            if session in self._sessions:
+                self._sessions.remove(session)
+        try:
+            session.logout()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            try:
+                session.logout()
+            except Exception:
+                pass
+
+
+class DraftSender(object):
+    def __init__(self, connect, mailbox, workers=4, retries=3, backoff=1.0):
+        self.pool = SessionPool(connect, workers)
+        self.mailbox = mailbox
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+
+    def send(self, items, render=None, sent=None):
+        # render(item) returns the message for item and sent(item) is called once
+        # its draft is created; both run on the worker threads. Items are pulled
+        # from the iterable as workers become free.
+        pending = iter(items)
+        latencies = []
+        failures = []
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    try:
+                        item = next(pending)
+                    except StopIteration:
+                        return
+
+                started = time.time()
+                try:
+                    self._append(render(item) if render is not None else item)
+                except Exception as error:
+                    with lock:
+                        failures.append((item, error))
+                else:
+                    with lock:
+                        latencies.append(time.time() - started)
+                    if sent is not None:
+                        sent(item)
+
+        started = time.time()
+        threads = [threading.Thread(target=work) for worker in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        self.pool.close()
+
+        return DeliveryStats(latencies, failures, elapsed)
+
+    def _append(self, message):
+        data = str(message)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        attempt = 0
+        while True:
+            if self.pool.error is not None:
+                raise self.pool.error
+
+            session = None
+            try:
+                session = self.pool.acquire()
+                session.append(self.mailbox, '', imaplib.Time2Internaldate(time.time()), data)
+            except TRANSIENT_ERRORS as error:
+                if session is not None:
+                    self.pool.discard(session)
+                attempt += 1
+                if attempt > self.retries:
+                    if session is None:
+                        self.pool.fail(error)
+                    raise
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            except Exception as error:
+                # No session means connecting or logging in failed, e.g. a wrong password
+                if session is not None:
+                    self.pool.release(session)
+                else:
+                    self.pool.fail(error)
+                raise
+            else:
+                self.pool.release(session)
+                return
+
+
+class DeliveryStats(object):
+    def __init__(self, latencies, failures, elapsed):
+        self.latencies = sorted(latencies)
+        self.failures = failures
+        self.elapsed = elapsed
+
+    def sent(self):
+        return len(self.latencies)
+
+    def throughput(self):
+        if self.elapsed == 0:
+            return 0
+        return self.sent() / self.elapsed
+
+    def latency(self, percentile):
+        if not self.latencies:
+            return 0
+        return self.latencies[int(round(percentile / 100.0 * (len(self.latencies) - 1)))]
+
+    def report(self):
+        print("Created", self.sent(), "drafts in", round(self.elapsed, 2), "s",
+              "(" + str(round(self.throughput(), 1)), "per second)")
+        print("Latency: median", round(self.latency(50), 3), "s, 95th percentile", round(self.latency(95), 3),
+              "s, max", round(self.latency(100), 3), "s")
+        if self.failures:
+            print("ERROR:", len(self.failures), "drafts could not be created")
+
+
+def open_outbox(path):
+    if path.endswith('/') or os.path.isdir(path):
+        return mailbox.Maildir(path, factory=None, create=True)
+    return mailbox.mbox(path, factory=None, create=True)
+
+
+def write_outbox(path, messages):
+    if path.endswith('/') or os.path.isdir(path):
+        outbox = open_outbox(path)
+        try:
+            if len(outbox):
+                raise ValueError("Outbox {} already holds {} messages, upload or remove them first".format(
+                    path, len(outbox)))
+            for message in messages:
+                outbox.add(message)
+        finally:
+            outbox.close()
+        return
+
+    # An mbox is written afresh next to the old one and renamed over it
+    def write_messages(temp_path):
+        outbox = mailbox.mbox(temp_path, factory=None)
+        try:
+            for message in messages:
+                outbox.add(message)
+            outbox.flush()
+        finally:
+            outbox.close()
+
+    outputs.replace_file(path, write_messages)
+
+
+def read_outbox(path):
+    outbox = open_outbox(path)
+    try:
+        for key in outbox.iterkeys():
+            yield outbox[key]
+    finally:
+        outbox.close()
+
+
+def send_outbox(sender, path):
+    # Uploaded messages leave the outbox, so only the failed ones are sent again
+    # next time. A Maildir message is deleted as soon as its draft is created;
+    # an mbox is rewritten with the failed messages once the upload ends.
+    outbox = open_outbox(path)
+    if isinstance(outbox, mailbox.Maildir):
+        try:
+            return sender.send(list(outbox.iterkeys()), outbox.get_message, outbox.discard)
+        finally:
+            outbox.close()
+
+    try:
+        messages = [outbox[key] for key in outbox.iterkeys()]
+    finally:
+        outbox.close()
+    stats = sender.send(range(len(messages)), messages.__getitem__)
+    failed = sorted(item for item, error in stats.failures)
+    write_outbox(path, [messages[item] for item in failed])
+    return stats
@@ -5,50 +5,71 @@ import sys
 from datetime import date
 #from dateutil.relativedelta import relativedelta
 import calendar
-import gnucashxml
+import bookcache
+import compactbook
 import getopt
-import re
-import imaplib
 import email.message
-import time
 import getpass
+import drafts
+from member import DEFAULT_TIERS, load_members, load_tiers
 
 
 DATE = 'Date'
 MEMBERS = 'Members'
 DONATING_MEMBERS = 'Donating members'
 
+DRAFTS_MAILBOX = '[Gmail]/Drafts'
+DEFAULT_WORKERS = 4
+
 
 def main(argv):
     now = date.today()
 
     try:
-        opts, args = getopt.getopt(argv, "a:b:c:")
+        opts, args = getopt.getopt(argv, "a:b:c:ko:s:t:u:w:")
     except getopt.GetoptError:
         print("argument error")
         sys.exit(2)
 
-    email_user = raw_input("Gmail username: ")
-    email_pass = getpass.getpass("Gmail password: ")
+    server = drafts.DEFAULT_SERVER
+    workers = DEFAULT_WORKERS
+    outbox = upload = None
+    tiers = DEFAULT_TIERS
+    compact = False
+
+    for opt, arg in opts:
+        if opt == '-k':
+            compact = True
+        elif opt == '-o':
+            outbox = arg
+        elif opt == '-u':
+            upload = arg
+        elif opt == '-s':
+            server = arg
+        elif opt == '-t':
+            tiers = load_tiers(arg)
+        elif opt == '-w':
+            workers = int(arg)
+
+    # -o only renders the reminders into a local outbox, -u only uploads an outbox
+    if upload:
+        drafts.send_outbox(draft_sender(server, workers), upload).report()
+        return
 
     filename = args[0]
-    book = gnucashxml.from_filename(filename)
+    # -k keeps the book in compact arrays instead of objects, see compactbook.py
+    if compact:
+        book = compactbook.load([filename], ["Active Members"])
+    else:
+        book = bookcache.load(filename, ["Active Members"])
 
 #    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 #    if today.day < MONTH_START_DAY:
 #        today -= relativedelta(months=+1)
 
-    active_members = []
-
-    active_member_accounts = book.find_account("Active Members")
-    for account in active_member_accounts.find_account("Full Members").children:
-        member = Member(account)
-        active_members.append(member)
-
-    for account in active_member_accounts.find_account("Student Members").children:
-        member = StudentMember(account)
-        active_members.append(member)
+    active_members = load_members(book, tiers)
 
+    late_members = []
     for member in active_members:
         if member.effective_balance() < 0:
             print(member.name(), "has a balance of", member.effective_balance(), "   ", member.email())
@@ -57,58 +78,40 @@ def main(argv):
                 print("ERROR:", member.name(), "does not have an email address on record")
 
             else:
-                gmail = imaplib.IMAP4_SSL('imap.gmail.com', port = 993)
-                gmail.login(email_user, email_pass)
-                gmail.select('[Gmail]/Drafts')
-
-                msg = email.message.Message()
-                msg['Subject'] = 'SkullSpace Dues'
-                msg['To'] = member.email()
-                msg['CC'] = 'admin@skullspace.ca'
-                msg.set_payload('Hello ' + member.name() + ',\n\nAccording to our records, your account balance is currently $' + str(member.effective_balance()) + '. Dues for the month of ' + calendar.month_name[now.month % 12 + 1] + ' were due on ' + calendar.month_name[now.month] + ' 15th. If you believe there is an issue with this record, please let us know.\n\nThank you,\n\n- Your SkullSpace Board of Directors')
-                # extra_late_warning = "Note that since you are more than 3 months behind, you are at risk of losing your membership. Please contact us to make arrangements as soon as possible."
-
-                gmail.append("[Gmail]/Drafts",
-                            '',
-                            imaplib.Time2Internaldate(time.time()),
-                            str(msg))
+                late_members.append(member)
         #balance = member.balance()
         #spacer1 = " " * (34 - len(member.name()))
         #spacer2 = " " * (6 - len(str(balance)))
         #print("Account", member.type(), ":", member.name(), spacer1, "Balance:", balance, spacer2, "Effective bal:", member.effective_balance(), "email:", member.email())
 
+    if outbox:
+        drafts.write_outbox(outbox, [dues_reminder(member, now) for member in late_members])
+        print("Wrote", len(late_members), "reminders to", outbox)
+        return
 
+    stats = draft_sender(server, workers).send(late_members, lambda member: dues_reminder(member, now))
+    stats.report()
 
-class Member(object):
-    monthy_dues = 40
-    membership_type = "Regular"
+    for member, error in stats.failures:
+        print("ERROR: could not create a draft for", member.name(), ":", error)
 
-    def __init__(self, account):
-        self.account = account
 
-    def type(self):
-        return self.membership_type
-
-    def name(self):
-        return self.account.name
-
-    def balance(self):
-        return sum((-1 * split.value) for split in self.account.splits)
+def draft_sender(server, workers):
+    email_user = raw_input("Gmail username: ")
+    email_pass = getpass.getpass("Gmail password: ")
 
-    def effective_balance(self):
-        return self.balance() - self.monthy_dues
+    return drafts.DraftSender(drafts.connector(server, email_user, email_pass, DRAFTS_MAILBOX), DRAFTS_MAILBOX, workers)
 
-    def email(self):
-        email = re.search("[^@ ]+@[^@ ]+\.[^@ ]+", self.account.description)
-        if email is None:
-            return None
-        else:
-            return email.group()
 
+def dues_reminder(member, now):
+    msg = email.message.Message()
+    msg['Subject'] = 'SkullSpace Dues'
+    msg['To'] = member.email()
+    msg['CC'] = 'admin@skullspace.ca'
+    msg.set_payload('Hello ' + member.name() + ',\n\nAccording to our records, your account balance is currently $' + str(member.effective_balance()) + '. Dues for the month of ' + calendar.month_name[now.month % 12 + 1] + ' were due on ' + calendar.month_name[now.month] + ' 15th. If you believe there is an issue with this record, please let us know.\n\nThank you,\n\n- Your SkullSpace Board of Directors')
+    # extra_late_warning = "Note that since you are more than 3 months behind, you are at risk of losing your membership. Please contact us to make arrangements as soon as possible."
 
-class StudentMember(Member):
-    monthy_dues = 20
-    membership_type = "Student"
+    return msg
 
 
 if __name__ == "__main__":
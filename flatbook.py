@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal
+from array import array
+
+
+# A lightweight stand-in for the gnucashxml object graph that can be
+# flattened into (and rebuilt from) compact columnar arrays. It only keeps
+# what the reports use, and transaction dates are stored without a timezone.
+
+EPOCH = datetime(1970, 1, 1)
+
+# Python 2's array module has no 64-bit typecode; C longs are 64 bits on the
+# platforms we run reports on
+try:
+    INT64 = array('q').typecode
+except ValueError:
+    INT64 = 'l'
+
+
+class Book(object):
+    __slots__ = ('root_account', 'transactions')
+
+    def __init__(self, root_account, transactions):
+        self.root_account = root_account
+        self.transactions = transactions
+
+    def walk(self):
+        return self.root_account.walk()
+
+    def find_account(self, name):
+        return self.root_account.find_account(name)
+
+
+class Account(object):
+    __slots__ = ('guid', 'name', 'actype', 'description', 'parent', 'children', 'splits')
+
+    def __init__(self, guid, name, actype, description=None, parent=None):
+        self.guid = guid
+        self.name = name
+        self.actype = actype
+        self.description = description
+        self.parent = parent
+        self.children = []
+        self.splits = []
+
+    def __repr__(self):
+        return "<Account '{}' {}...>".format(self.name, self.guid[:10])
+
+    def walk(self):
+        accounts = deque([self])
+        while accounts:
+            account = accounts.popleft()
+            children = list(account.children)
+            yield (account, children, account.splits)
+            accounts.extend(children)
+
+    def find_account(self, name):
+        for account, children, splits in self.walk():
+            if account.name == name:
+                return account
+
+    def get_all_splits(self):
+        split_list = []
+        for account, children, splits in self.walk():
+            split_list.extend(splits)
+        return sorted(split_list, key=lambda split: split.transaction.date)
+
+
+class Transaction(object):
+    __slots__ = ('guid', 'date', 'description', 'splits')
+
+    def __init__(self, guid, date, description=None):
+        self.guid = guid
+        self.date = date
+        self.description = description
+        self.splits = []
+
+    def __repr__(self):
+        return "<Transaction on {} '{}' {}...>".format(self.date, self.description, self.guid[:6])
+
+
+class Split(object):
+    __slots__ = ('value', 'account', 'transaction')
+
+    def __init__(self, value, account, transaction):
+        self.value = value
+        self.account = account
+        self.transaction = transaction
+
+    def __repr__(self):
+        return "<Split {} '{}' {}>".format(self.transaction.date, self.transaction.description, self.value)
+
+
+def flatten(book):
+    accounts = []
+    account_index = {}
+    for account, children, splits in book.root_account.walk():
+        account_index[account.guid] = len(accounts)
+        accounts.append(account)
+
+    transactions = list(book.transactions)
+
+    columns = {
+        'account_guid': [account.guid for account in accounts],
+        'account_name': [account.name for account in accounts],
+        'account_type': [account.actype for account in accounts],
+        'account_description': [account.description for account in accounts],
+        'account_parent': array('l', [account_index[account.parent.guid] if account.parent is not None else -1
+                                      for account in accounts]),
+        'transaction_guid': [transaction.guid for transaction in transactions],
+        'transaction_description': [transaction.description for transaction in transactions],
+        'transaction_date': array(INT64),
+        'split_transaction': array('l'),
+        'split_account': array('l'),
+        'split_value': array(INT64),
+        'split_exponent': array('b'),
+    }
+
+    for number, transaction in enumerate(transactions):
+        date = transaction.date.replace(tzinfo=None) - EPOCH
+        columns['transaction_date'].append(date.days * 86400 + date.seconds)
+
+        for split in transaction.splits:
+            sign, digits, exponent = split.value.as_tuple()
+            coefficient = int(''.join(str(digit) for digit in digits))
+
+            columns['split_transaction'].append(number)
+            columns['split_account'].append(account_index[split.account.guid])
+            columns['split_value'].append(-coefficient if sign else coefficient)
+            columns['split_exponent'].append(exponent)
+
+    return columns
+
+
+def unflatten(columns):
+    accounts = []
+    root_account = None
+    for number, guid in enumerate(columns['account_guid']):
+        parent = columns['account_parent'][number]
+        account = Account(guid=guid,
+                          name=columns['account_name'][number],
+                          actype=columns['account_type'][number],
+                          description=columns['account_description'][number],
+                          parent=accounts[parent] if parent >= 0 else None)
+        if account.parent is None:
+            root_account = account
+        else:
+            account.parent.children.append(account)
+        accounts.append(account)
+
+    transactions = []
+    for number, guid in enumerate(columns['transaction_guid']):
+        transactions.append(Transaction(guid=guid,
+                                        date=EPOCH + timedelta(seconds=columns['transaction_date'][number]),
+                                        description=columns['transaction_description'][number]))
+
+    split_transactions = columns['split_transaction']
+    split_accounts = columns['split_account']
+    split_values = columns['split_value']
+    split_exponents = columns['split_exponent']
+    for number in range(len(split_transactions)):
+        transaction = transactions[split_transactions[number]]
+        account = accounts[split_accounts[number]]
+        split = Split(value=Decimal(split_values[number]).scaleb(split_exponents[number]),
+                      account=account,
+                      transaction=transaction)
+        transaction.splits.append(split)
+        account.splits.append(split)
+
+    return Book(root_account=root_account, transactions=transactions)
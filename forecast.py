@@ -4,10 +4,20 @@ from __future__ import print_function
 import sys
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-import calendar
-import gnucashxml
-import csv
+import consolidate
+import compactbook
 import getopt
+import cProfile
+from periods import PeriodCalendar
+from membership import Membership
+from classify import AccountClassifier
+from incremental import ForecastState
+import montecarlo
+import projection
+import classify
+import aggregate
+import outputs
+import instrument
 
 
 DATE = 'Date'
@@ -34,21 +44,138 @@ PROJECTED_FOOD_EXPENSES = 'Projected food expenses'
 CAPITAL_TARGET = 'Target balance (3 month buffer)'
 FOOD_PROFIT = 'Food profit'
 PROJECTED_FOOD_PROFIT = 'Projected food profit'
+SIMULATED_CAPITAL_LOW = 'Simulated capital (5th percentile)'
+SIMULATED_CAPITAL_MEDIAN = 'Simulated capital (median)'
+SIMULATED_CAPITAL_HIGH = 'Simulated capital (95th percentile)'
+BELOW_TARGET_PROBABILITY = 'Probability below target'
+# Only shown on the console
+EXPECTED_INCOME = 'Total expected income'
+BOOKED_EXPENSES = 'Booked expenses'
+
+# The columns that are not amounts; the rest, projected member counts too, are
+# written as decimals
+COUNT_COLUMNS = set([DATE, MEMBERS, NEW_MEMBERS, LOST_MEMBERS, DONATING_MEMBERS, BELOW_TARGET_PROBABILITY])
 
 MONTH_START_DAY = 6
+CALENDAR = PeriodCalendar(MONTH_START_DAY)
 DEFAULT_MONTHS = 6
 
 EXEMPT_EXPENSE_ACCOUNTS = ["Anti-social 10-04", "Hacker Jeopardy Ron's Revenge", "Groceries"]
 
+# Used unless a rules file is given with -r, see classify.py for the format
+DEFAULT_ACCOUNT_RULES = {
+    'exempt': EXEMPT_EXPENSE_ACCOUNTS,
+    'rent': ["Rent"],
+    'food': ["Groceries"],
+}
+
+# Columns each column is computed from; -l COLUMN[,...] computes only the given columns and what they
+# depend on. Columns not listed here come straight from the book
+COLUMN_DEPENDENCIES = {
+    CAPITAL: [ASSETS, LIABILITIES],
+    CAPITAL_TARGET: [EXPENSES],
+    FOOD_PROFIT: [FOOD_DONATIONS, FOOD_EXPENSES],
+    EXPECTED_INCOME: [DUES, DONATIONS, FOOD_DONATIONS],
+    BOOKED_EXPENSES: [EXPENSES],
+    PROJECTED_CAPITAL: [CAPITAL, DUES, DONATIONS, EXPENSES],
+    PROJECTED_DUES: [DUES],
+    PROJECTED_DONATIONS: [DONATIONS],
+    PROJECTED_MEMBERS: [MEMBERS],
+    PROJECTED_DONATING_MEMBERS: [DONATING_MEMBERS],
+    PROJECTED_FOOD_DONATIONS: [FOOD_DONATIONS],
+    PROJECTED_FOOD_EXPENSES: [FOOD_EXPENSES],
+    SIMULATED_CAPITAL_LOW: [CAPITAL, DUES, DONATIONS, EXPENSES, FOOD_PROFIT, CAPITAL_TARGET],
+    SIMULATED_CAPITAL_MEDIAN: [CAPITAL, DUES, DONATIONS, EXPENSES, FOOD_PROFIT, CAPITAL_TARGET],
+    SIMULATED_CAPITAL_HIGH: [CAPITAL, DUES, DONATIONS, EXPENSES, FOOD_PROFIT, CAPITAL_TARGET],
+    BELOW_TARGET_PROBABILITY: [CAPITAL, DUES, DONATIONS, EXPENSES, FOOD_PROFIT, CAPITAL_TARGET],
+}
+
+# Projection series (see get_projection_series) behind each projected column
+PROJECTION_SERIES = {
+    PROJECTED_CAPITAL: ['income', 'expenses', 'rent'],
+    CAPITAL_TARGET: ['expenses', 'rent'],
+    FOOD_PROFIT: ['food-donations', 'food-expenses'],
+    PROJECTED_DUES: ['dues'],
+    PROJECTED_DONATIONS: ['donations'],
+    PROJECTED_MEMBERS: ['members'],
+    PROJECTED_DONATING_MEMBERS: ['donating-members'],
+    PROJECTED_FOOD_DONATIONS: ['food-donations'],
+    PROJECTED_FOOD_EXPENSES: ['food-expenses'],
+}
+
+# History column behind each projection series but income and rent, see get_projection_value
+PROJECTION_SERIES_COLUMNS = {
+    'expenses': EXPENSES,
+    'dues': DUES,
+    'donations': DONATIONS,
+    'members': MEMBERS,
+    'donating-members': DONATING_MEMBERS,
+    'food-donations': FOOD_DONATIONS,
+    'food-expenses': FOOD_EXPENSES,
+}
+
+# Console report of each history month, printed unless -q is given
+HISTORY_REPORT = [
+    ("Total assets: ", ASSETS),
+    ("Total liability: ", LIABILITIES),
+    ("Available capital: ", CAPITAL),
+    ("Dues collected last month: ", DUES),
+    ("Dues paying members: ", MEMBERS),
+    ("Members gained: ", NEW_MEMBERS),
+    ("Members lost: ", LOST_MEMBERS),
+    ("Regular donations collected last month: ", DONATIONS),
+    ("Regularly donating members: ", DONATING_MEMBERS),
+    ("Food donations: ", FOOD_DONATIONS),
+    ("Total expected income: ", EXPECTED_INCOME),
+    ("Expenses: ", BOOKED_EXPENSES),
+    ("Income: ", INCOME),
+    ("Food expenses: ", FOOD_EXPENSES),
+]
+
+# Projection model of each projected column, changed with -f COLUMN=MODEL[,...]; see projection.py.
+# Income is the dues plus donations behind projected capital
+DEFAULT_PROJECTION_MODELS = {
+    'income': 'mean',
+    'expenses': 'mean',
+    'dues': 'last',
+    'donations': 'last',
+    'members': 'last',
+    'donating-members': 'last',
+    'food-donations': 'mean',
+    'food-expenses': 'mean',
+}
+
+# This is the first month of the 2014 books, but the membership dues were recorded in the 2013 books.
+# Overrides are only used when the book before isn't loaded, see get_member_count
+MEMBER_COUNT_OVERRIDES = {datetime(2014, 3, MONTH_START_DAY): 60}
+
+# Only transactions touching these account subtrees are loaded from the book
+REPORT_ACCOUNTS = ["Current Assets", "Active Members", "Former Members", "Landlord", "Unknown", "Member Dues",
+                   "Regular donations", "Expenses", "Income", "Groceries", "Food and Drink Donations"]
+
 
 def main(argv):
     try:
-        opts, args = getopt.getopt(argv, "a:b:c:")
+        opts, args = getopt.getopt(argv, "a:b:c:f:i:j:kl:m:o:p:qr:s:tw:")
     except getopt.GetoptError:
         print("argument error")
         sys.exit(2)
 
     months_after = months_before = months_context = None
+    rules = DEFAULT_ACCOUNT_RULES
+    state_filename = None
+    simulated_paths = None
+    jobs = None
+    compact = False
+    models = DEFAULT_PROJECTION_MODELS
+    backtest = False
+    columns = None
+    log = print
+    profile_filename = stats_filename = None
+    # forecast.csv is written unless -w streams the rows elsewhere, -o FORMAT:PATH adds more outputs,
+    # see outputs.py
+    stream = None
+    report_outputs = []
 
     for opt, arg in opts:
         if opt == '-a':
@@ -57,407 +184,505 @@ def main(argv):
             months_before = int(arg)
         elif opt == '-c':
             months_context = int(arg)
+        elif opt == '-f':
+            models = projection.parse_models(arg, models)
+        elif opt == '-i':
+            state_filename = arg
+        elif opt == '-j':
+            jobs = int(arg)
+        elif opt == '-k':
+            compact = True
+        elif opt == '-l':
+            columns = get_columns(arg)
+        elif opt == '-m':
+            simulated_paths = int(arg)
+        elif opt == '-o':
+            report_outputs.append(outputs.open_output(arg))
+        elif opt == '-p':
+            profile_filename = arg
+        elif opt == '-q':
+            log = quiet
+        elif opt == '-r':
+            rules = classify.load_rules(arg)
+        elif opt == '-s':
+            stats_filename = arg
+        elif opt == '-t':
+            backtest = True
+        elif opt == '-w':
+            stream = outputs.open_stream(arg)
+
+    report_outputs.insert(0, stream or outputs.CsvOutput('forecast.csv'))
+    # The console report would be mixed into a stream on stdout
+    if outputs.is_stdout(stream):
+        log = quiet
 
     future = months_after if months_after else months_context if months_context else DEFAULT_MONTHS
     past = months_before if months_before else months_context if months_context else DEFAULT_MONTHS
 
-
-    filename = args[0]
-    book = gnucashxml.from_filename(filename)
-
+    # -s writes per-stage and per-getter timings as JSON, -p a cProfile dump
+    instruments = instrument.Instruments()
+    if stats_filename:
+        module = sys.modules[__name__]
+        instruments.wrap(module, [name for name in dir(module) if name.startswith('get_')])
+    profile = None
+    if profile_filename:
+        profile = cProfile.Profile()
+        profile.enable()
+
+    run = datetime.now()
+    # Several books, e.g. one per fiscal year, are parsed in parallel (-j processes) and consolidated
+    # -k keeps the book in compact arrays instead of objects, see compactbook.py
+    instruments.stage('load')
+    book = load_book(args, compact, jobs)
+    instruments.stage('index')
+    ledger = compactbook.open_ledger(book, MONTH_START_DAY)
+    instruments.ledger = ledger
+    membership = Membership(ledger)
+    classifier = AccountClassifier(ledger, rules)
+
+    # In incremental mode (-i) only periods with new or edited transactions are recomputed
+    state = None
+    if state_filename:
+        state = open_state(state_filename, compact, rules)
+
+    # -t scores the projection models on the history instead of writing the forecast, and needs every column
+    if backtest:
+        history = get_forecast(ledger, membership, classifier, report_today(), past, future, state,
+                               simulated_paths, instruments, log, models)
+
+        instruments.stage('backtest')
+        # Rent is booked ahead, and follows the expenses model anyway
+        series = get_projection_series(classifier, [data_point for data_point in history if DUES in data_point],
+                                       DEFAULT_PROJECTION_MODELS.keys())
+        write_backtest(projection.backtest(series, get_backtest_models(models)))
+    else:
+        rows = iter_forecast(ledger, membership, classifier, report_today(), past, future, state, simulated_paths,
+                             instruments, log, models, columns)
+        # A single output that reads the rows once gets each row as soon as it is computed
+        if len(report_outputs) > 1 or not report_outputs[0].single_pass:
+            rows = list(rows)
+            instruments.stage('output')
+        fieldnames = get_fieldnames(simulated_paths, columns)
+
+        for report_output in report_outputs:
+            report_output.write(fieldnames, rows, run)
+
+    instruments.stop()
+    instruments.restore()
+
+    if profile:
+        profile.disable()
+        profile.dump_stats(profile_filename)
+
+    if stats_filename:
+        instruments.write(stats_filename)
+
+
+def load_book(filenames, compact=False, jobs=None):
+    # The report accounts of one or more books, see consolidate.py and compactbook.py
+    if compact:
+        return compactbook.load(filenames, REPORT_ACCOUNTS, jobs)
+    return consolidate.load(filenames, REPORT_ACCOUNTS, jobs)
+
+
+def open_state(state_filename, compact=False, rules=DEFAULT_ACCOUNT_RULES):
+    # Per-period results saved by incremental runs (-i), see incremental.py; with no
+    # filename they are only kept in memory, e.g. by service.py between book reloads
+    return ForecastState(state_filename, (MONTH_START_DAY, compact, sorted(rules.items())))
+
+
+def report_today():
     today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     if today.day + 5 < MONTH_START_DAY:
         today -= relativedelta(months=+1)
+    return today
+
+
+def get_forecast(ledger, membership, classifier, today, past, future, state=None, simulated_paths=None,
+                 instruments=None, log=print, models=None, columns=None):
+    # History rows for the past months followed by projection rows, as written to forecast.csv
+    return list(iter_forecast(ledger, membership, classifier, today, past, future, state, simulated_paths,
+                              instruments, log, models, columns))
+
+
+def iter_forecast(ledger, membership, classifier, today, past, future, state=None, simulated_paths=None,
+                  instruments=None, log=print, models=None, columns=None):
+    # The forecast rows, each yielded as soon as its month is computed, so a
+    # long range never has to be held in memory. Only the given columns (all by
+    # default) and the columns they depend on are computed. Simulated capital
+    # needs the whole projection, so with simulated_paths the rows are held
+    # back until the simulation has run
+    if instruments is None:
+        instruments = instrument.Instruments()
+
+    columns = get_fieldnames(simulated_paths, columns)
+    required = get_required_columns(columns)
+    if state:
+        # The saved state has to hold every total
+        required |= get_required_columns(get_fieldnames(simulated_paths))
+
+    rows = iter_forecast_rows(ledger, membership, classifier, today, past, future, state, instruments, log,
+                              models or DEFAULT_PROJECTION_MODELS, required)
+    if simulated_paths:
+        rows = list(rows)
+        instruments.stage('simulation')
+        simulate_capital(classifier, rows, list(report_days(today - relativedelta(months=+past), today)),
+                         simulated_paths, log)
+
+    columns = set(columns)
+    for data_point in rows:
+        yield dict((column, value if column in COUNT_COLUMNS else outputs.money(value))
+                   for column, value in data_point.items() if column in columns)
+
+
+def iter_forecast_rows(ledger, membership, classifier, today, past, future, state, instruments, log, models,
+                       required):
     future_delta = relativedelta(months=+future)
     past_delta = relativedelta(months=+past)
     start = today - past_delta
     end = today + future_delta
 
-    history = []
-
-    for month in report_days(start, today):
-        print(month)
-        assets = get_assets_on_date(book, month)
-        liabilities = get_liability_on_date(book, month)
-        capital = assets + liabilities
-        dues = get_dues_for_month(book, month)
-        donations = get_donations_for_month(book, month)
-        food_donations = get_food_donations_for_month(book, month)
-        members = get_paying_members(book, month)
-        new_members = get_new_members(book, month)
-        lost_members = get_lost_members(book, month)
-        donating_members = get_donating_members(book, month)
-        expenses = get_expenses_for_month(book, month)
-        income = get_income_for_month(book, month)
-        food_expenses = get_food_expenses_for_month(book, month)
-
-        print("Total assets: ", assets)
-        print("Total liability: ", liabilities)
-        print("Available capital: ", capital)
-        print("Dues collected last month: ", dues)
-        print("Dues paying members: ", members)
-        print("Members gained: ", new_members)
-        print("Members lost: ", lost_members)
-        print("Regular donations collected last month: ", donations)
-        print("Regularly donating members: ", donating_members)
-        print("Food donations: ", food_donations)
-        print("Total expected income: ", (dues + donations + food_donations))
-        print("Expenses: ", expenses)
-        print("Income: ", income)
-        print("Food expenses: ", food_expenses)
-
-        history.append({
-            DATE: month,
-            ASSETS: assets,
-            LIABILITIES: liabilities,
-            CAPITAL: capital,
-            DUES: dues,
-            DONATIONS: donations,
-            FOOD_DONATIONS: food_donations,
-            MEMBERS: members,
-            DONATING_MEMBERS: donating_members,
-            EXPENSES: expenses * -1,
-            FOOD_EXPENSES: food_expenses,
-            CAPITAL_TARGET: expenses * -3,
-            FOOD_PROFIT: food_donations + food_expenses,
-            NEW_MEMBERS: new_members,
-            LOST_MEMBERS: lost_members,
-            INCOME: income
-        })
-
-        print()
-
-    income = get_projected_income(history)
-    income = get_historical_membership_income_average(book, start, today)
-    expenses = get_projected_expenses(history) - get_historical_rent_expenses_average(book, start, today)
-
-    print("Projected income: ", income)
-    print("Projected expenses: ", expenses, " (plus monthly rent amount)")
-
-    food_income = get_projected_food_income(history)
-    food_expenses = get_projected_food_expenses(history)
-
-    history[-1][PROJECTED_CAPITAL] = history[-1][CAPITAL]
-    history[-1][PROJECTED_DUES] = history[-1][DUES]
-    history[-1][PROJECTED_DONATIONS] = history[-1][DONATIONS]
-    history[-1][PROJECTED_MEMBERS] = history[-1][MEMBERS]
-    history[-1][PROJECTED_DONATING_MEMBERS] = history[-1][DONATING_MEMBERS]
-
-    for month in report_days(today, end):
-        print(month)
-
-        history.append({
-            DATE: month,
-            PROJECTED_CAPITAL: history[-1][PROJECTED_CAPITAL] + income + expenses + get_rent_expenses_for_month(book, month),
-            PROJECTED_DUES: history[-1][PROJECTED_DUES],
-            PROJECTED_DONATIONS: history[-1][PROJECTED_DONATIONS],
-            PROJECTED_MEMBERS: history[-1][PROJECTED_MEMBERS],
-            PROJECTED_DONATING_MEMBERS: history[-1][PROJECTED_DONATING_MEMBERS],
-            PROJECTED_FOOD_DONATIONS: food_income,
-            PROJECTED_FOOD_EXPENSES: food_expenses,
-            CAPITAL_TARGET: (expenses + get_rent_expenses_for_month(book, month)) * -3,
-            FOOD_PROFIT: food_income + food_expenses,
-        })
-
-    with open('forecast.csv', 'wb') as csvfile:
-        fieldnames = [
-            DATE,
-            ASSETS,
-            LIABILITIES,
-            PROJECTED_CAPITAL,
-            CAPITAL,
-            PROJECTED_DUES,
-            DUES,
-            PROJECTED_DONATIONS,
-            DONATIONS,
-            PROJECTED_MEMBERS,
-            MEMBERS,
-            PROJECTED_DONATING_MEMBERS,
-            DONATING_MEMBERS,
-            EXPENSES,
-            PROJECTED_FOOD_DONATIONS,
-            FOOD_DONATIONS,
-            PROJECTED_FOOD_EXPENSES,
-            FOOD_EXPENSES,
-            CAPITAL_TARGET,
-            FOOD_PROFIT,
-            NEW_MEMBERS,
-            LOST_MEMBERS,
-            INCOME,
+    months = list(report_days(start, today))
+
+    stale_months = months
+    if state:
+        stale_months = state.stale_months(ledger, months)
+        log("Recomputing", len(stale_months), "of", len(months), "months")
+
+    instruments.stage('aggregate')
+    monthly_totals = dict(zip(stale_months, get_monthly_aggregates(classifier, stale_months, required)))
+
+    # Console lines whose columns are computed anyway; none at all in quiet runs
+    report = []
+    if log is not quiet:
+        report = [(label, column) for label, column in HISTORY_REPORT
+                  if column in required or set(COLUMN_DEPENDENCIES.get(column, [column])) <= required]
+
+    # The projection models are fed each month as it is computed
+    projections = get_projection_models(models, set(name for column in required
+                                                    for name in PROJECTION_SERIES.get(column, [])))
+
+    instruments.stage('history')
+    data_point = None
+    for month in months:
+        log(month)
+        if month in monthly_totals:
+            totals = monthly_totals.pop(month)
+            if NEW_MEMBERS in required:
+                totals[NEW_MEMBERS] = get_new_members(membership, month, log)
+            if LOST_MEMBERS in required:
+                totals[LOST_MEMBERS] = get_lost_members(membership, month, log)
+            if state:
+                state.update(ledger, month, totals)
+        else:
+            totals = state.totals(month)
+
+        data_point = LazyRow(get_history_getters(ledger, month, totals), {DATE: month})
+        for column in required:
+            if column in data_point.getters:
+                data_point[column]
+
+        for label, column in report:
+            log(label, data_point[column])
+
+        for name, model in projections.items():
+            model.add(get_projection_value(classifier, data_point, name))
+
+        # The projection starts from the last month's actual values
+        if month == months[-1]:
+            for column, projected in ((CAPITAL, PROJECTED_CAPITAL), (DUES, PROJECTED_DUES),
+                                      (DONATIONS, PROJECTED_DONATIONS), (MEMBERS, PROJECTED_MEMBERS),
+                                      (DONATING_MEMBERS, PROJECTED_DONATING_MEMBERS)):
+                if projected in required:
+                    data_point[projected] = data_point[column]
+
+        yield data_point
+
+        log()
+
+    if state:
+        state.save(ledger.book)
+
+    instruments.stage('averages')
+    if 'income' in projections:
+        log("Projected income: ", get_projected_income(projections, 1))
+    if 'expenses' in projections:
+        log("Projected expenses: ", get_projected_expenses(projections, 1), " (plus monthly rent amount)")
+
+    instruments.stage('projection')
+    for data_point in iter_projection_rows(classifier, data_point, projections, list(report_days(today, end)),
+                                           required, log):
+        yield data_point
+
+
+def iter_projection_rows(classifier, data_point, projections, months, required, log=print):
+    # Projection rows for the given months, following the last history row
+    # data_point, from projection models already fed the history
+    for step, month in enumerate(months, 1):
+        log(month)
+
+        data_point = LazyRow(get_projection_getters(classifier, data_point, projections, step, month),
+                             {DATE: month})
+        for column in required:
+            if column in data_point.getters:
+                data_point[column]
+
+        yield data_point
+
+
+class LazyRow(dict):
+    # A forecast row whose columns are computed the first time they are read
+    def __init__(self, getters, values):
+        dict.__init__(self, values)
+        self.getters = getters
+
+    def __missing__(self, column):
+        value = self[column] = self.getters[column](self)
+        return value
+
+
+def get_required_columns(columns):
+    # The columns and every column they are computed from
+    required = set()
+    pending = list(columns)
+    while pending:
+        column = pending.pop()
+        if column not in required:
+            required.add(column)
+            pending.extend(COLUMN_DEPENDENCIES.get(column, []))
+    return required
+
+
+def get_history_getters(ledger, month, totals):
+    getters = {
+        ASSETS: lambda row: get_assets_on_date(ledger, month),
+        LIABILITIES: lambda row: get_liability_on_date(ledger, month),
+        CAPITAL: lambda row: row[ASSETS] + row[LIABILITIES],
+        MEMBERS: lambda row: get_member_count(ledger, month, totals[MEMBERS]),
+        EXPENSES: lambda row: totals[EXPENSES] * -1,
+        CAPITAL_TARGET: lambda row: totals[EXPENSES] * -3,
+        FOOD_PROFIT: lambda row: row[FOOD_DONATIONS] + row[FOOD_EXPENSES],
+        EXPECTED_INCOME: lambda row: row[DUES] + row[DONATIONS] + row[FOOD_DONATIONS],
+        BOOKED_EXPENSES: lambda row: totals[EXPENSES],
+    }
+    for column in (DUES, DONATIONS, FOOD_DONATIONS, NEW_MEMBERS, LOST_MEMBERS, DONATING_MEMBERS, INCOME,
+                   FOOD_EXPENSES):
+        getters[column] = lambda row, column=column: totals[column]
+    return getters
+
+
+def get_projection_getters(classifier, previous, projections, step, month):
+    getters = {
+        PROJECTED_CAPITAL: lambda row: (previous[PROJECTED_CAPITAL] + get_projected_income(projections, step)
+                                        + get_projected_expenses(projections, step)
+                                        + get_rent_expenses_for_month(classifier, month)),
+        PROJECTED_FOOD_DONATIONS: lambda row: projections['food-donations'].forecast(step),
+        PROJECTED_FOOD_EXPENSES: lambda row: projections['food-expenses'].forecast(step),
+        CAPITAL_TARGET: lambda row: (get_projected_expenses(projections, step)
+                                     + get_rent_expenses_for_month(classifier, month)) * -3,
+        FOOD_PROFIT: lambda row: row[PROJECTED_FOOD_DONATIONS] + row[PROJECTED_FOOD_EXPENSES],
+    }
+    for column, name in ((PROJECTED_DUES, 'dues'), (PROJECTED_DONATIONS, 'donations'), (PROJECTED_MEMBERS, 'members'),
+                         (PROJECTED_DONATING_MEMBERS, 'donating-members')):
+        getters[column] = lambda row, name=name: projections[name].forecast(step)
+    return getters
+
+
+def get_fieldnames(simulated_paths=None, columns=None):
+    fieldnames = [
+        DATE,
+        ASSETS,
+        LIABILITIES,
+        PROJECTED_CAPITAL,
+        CAPITAL,
+        PROJECTED_DUES,
+        DUES,
+        PROJECTED_DONATIONS,
+        DONATIONS,
+        PROJECTED_MEMBERS,
+        MEMBERS,
+        PROJECTED_DONATING_MEMBERS,
+        DONATING_MEMBERS,
+        EXPENSES,
+        PROJECTED_FOOD_DONATIONS,
+        FOOD_DONATIONS,
+        PROJECTED_FOOD_EXPENSES,
+        FOOD_EXPENSES,
+        CAPITAL_TARGET,
+        FOOD_PROFIT,
+        NEW_MEMBERS,
+        LOST_MEMBERS,
+        INCOME,
+    ]
+
+    if columns is not None:
+        fieldnames = [DATE] + [fieldname for fieldname in fieldnames[1:] if fieldname in columns]
+
+    if simulated_paths:
+        fieldnames += [
+            SIMULATED_CAPITAL_LOW,
+            SIMULATED_CAPITAL_MEDIAN,
+            SIMULATED_CAPITAL_HIGH,
+            BELOW_TARGET_PROBABILITY,
         ]
 
+    return fieldnames
 
 
-        writer = csv.DictWriter(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL, fieldnames=fieldnames)
-
-        writer.writeheader()
-        for history_item in history:
-            writer.writerow(history_item)
-
-
-def get_assets_on_date(book, date):
-    assets = book.find_account("Current Assets")
-
-    asset_total = 0
-    for account in assets.children:
-        if account.name != "Prepaid Rent":
-            asset_total += sum(split.value for split in account.splits if split.transaction.date.replace(tzinfo=None) <= date)
-
-    return asset_total
-
-
-def get_liability_on_date(book, date):
-    liabilities = book.find_account("Active Members")
-    liability_total = sum(split.value for split in liabilities.get_all_splits() if split.transaction.date.replace(tzinfo=None) <= date)
+def simulate_capital(classifier, history, months, paths, log=print):
+    # Net change of each historical month, with its rent taken out since the
+    # projection adds the rent booked for each future month instead
+    samples = []
+    for month, data_point in zip(months, history):
+        samples.append(data_point[DUES] + data_point[DONATIONS] - data_point[EXPENSES] + data_point[FOOD_PROFIT]
+                       - get_rent_expenses_for_month(classifier, month))
 
-    liabilities = book.find_account("Former Members")
-    liability_total += sum(split.value for split in liabilities.get_all_splits() if split.transaction.date.replace(tzinfo=None) <= date)
+    projection = history[len(months):]
+    rent = [get_rent_expenses_for_month(classifier, data_point[DATE]) for data_point in projection]
+    targets = [data_point[CAPITAL_TARGET] for data_point in projection]
 
-    liabilities = book.find_account("Landlord")
-    liability_total += sum(split.value for split in liabilities.get_all_splits() if split.transaction.date.replace(tzinfo=None) <= date)
+    results = montecarlo.simulate(history[len(months) - 1][CAPITAL], samples, rent, targets, paths)
 
-    liabilities = book.find_account("Unknown")
-    liability_total += sum(split.value for split in liabilities.get_all_splits() if split.transaction.date.replace(tzinfo=None) <= date)
+    for data_point, result in zip(projection, results):
+        data_point[SIMULATED_CAPITAL_LOW] = result['percentiles'][5]
+        data_point[SIMULATED_CAPITAL_MEDIAN] = result['percentiles'][50]
+        data_point[SIMULATED_CAPITAL_HIGH] = result['percentiles'][95]
+        data_point[BELOW_TARGET_PROBABILITY] = result['below_target']
 
-    return liability_total
+    log("Simulated", paths, "capital paths")
+    log("Chance of dropping below the 3 month buffer: ", results[-1]['dropped_below_target'] if results else 0)
 
 
-def get_dues_for_month(book, month_end):
-    end_date = month_end
-    start_date = subtract_month(month_end)
+def get_monthly_aggregates(classifier, months, columns=None):
+    ledger = classifier.ledger
 
-    member_dues = book.find_account("Member Dues")
-    dues = 0
-    for split in member_dues.get_all_splits():
-        if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-            dues += split.value
+    return aggregate.aggregate(ledger, months, [column for column in [
+        (DUES, aggregate.SUM, [ledger.account("Member Dues")], -1),
+        (DONATIONS, aggregate.SUM, [ledger.account("Regular donations")], -1),
+        (FOOD_DONATIONS, aggregate.SUM, [ledger.account("Food and Drink Donations")], -1),
+        (EXPENSES, aggregate.SUM, classifier.accounts(classify.EXPENSE, classify.RENT), -1),
+        (INCOME, aggregate.SUM, classifier.accounts(classify.INCOME), -1),
+        (FOOD_EXPENSES, aggregate.SUM, classifier.accounts(classify.FOOD), -1),
+        (MEMBERS, aggregate.COUNT, [ledger.account("Member Dues")], 1),
+        (DONATING_MEMBERS, aggregate.COUNT, [ledger.account("Regular donations")], 1),
+    ] if columns is None or column[0] in columns])
 
-    return dues * -1
 
+def get_assets_on_date(ledger, date):
+    assets = ledger.account("Current Assets")
 
-def get_paying_members(book, month_end):
-    # This is the first month of the 2014 books, but the membership dues were recorded in the 2013 books
-    if month_end == datetime(2014, 3, MONTH_START_DAY):
-        return 60
+    asset_total = 0
+    for account in assets.children:
+        if account.name != "Prepaid Rent":
+            asset_total += ledger.balance(account, date, subtree=False)
 
-    end_date = month_end
-    start_date = subtract_month(month_end)
+    return asset_total
 
-    member_dues = book.find_account("Member Dues")
-    members = 0
-    for split in member_dues.get_all_splits():
-        if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-            members += len(split.transaction.splits) - 1
 
-    return members
+def get_liability_on_date(ledger, date):
+    liability_total = 0
+    for name in ["Active Members", "Former Members", "Landlord", "Unknown"]:
+        liabilities = ledger.account(name)
+        liability_total += ledger.balance(liabilities, date)
 
+    return liability_total
 
-def get_member_list(book, month_end):
-    end_date = month_end
-    start_date = subtract_month(month_end)
 
-    member_dues = book.find_account("Member Dues")
-    members = []
-    for split in member_dues.get_all_splits():
-        if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-            for subsplit in split.transaction.splits:
-                if subsplit.account.name != "Member Dues":
-                    members.append(subsplit.account.name)
+def get_member_count(ledger, month_end, members):
+    # An override stands in for dues recorded in an earlier book, so it only
+    # applies when the period before has no dues at all
+    if month_end in MEMBER_COUNT_OVERRIDES:
+        if not ledger.splits(ledger.account("Member Dues"), ledger.period_start(month_end)):
+            return MEMBER_COUNT_OVERRIDES[month_end]
 
     return members
 
 
-def get_new_members(book, month_end):
-    current_members = get_member_list(book, month_end)
-    last_months_members = get_member_list(book, subtract_month(month_end))
-
-    new_members = set(current_members).difference(set(last_months_members))
-    print("new_members:", new_members)
+def get_new_members(membership, month_end, log=print):
+    new_members = membership.new_members(month_end)
+    log("new_members:", new_members)
 
     return len(new_members)
 
 
-def get_lost_members(book, month_end):
-    current_members = get_member_list(book, month_end)
-    last_months_members = get_member_list(book, subtract_month(month_end))
-
-    lost_members = set(last_months_members).difference(set(current_members))
-    print("lost_members:", lost_members)
+def get_lost_members(membership, month_end, log=print):
+    lost_members = membership.lost_members(month_end)
+    log("lost_members:", lost_members)
 
     return len(lost_members)
 
 
-def get_donations_for_month(book, month_end):
-    end_date = month_end
-    start_date = subtract_month(month_end)
-
-    member_donations = book.find_account("Regular donations")
-    donations = 0
-    for split in member_donations.get_all_splits():
-        if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-            donations += split.value
-
-    return donations * -1
-
-
-def get_expenses_for_month(book, month_end):
-    end_date = month_end
-    start_date = subtract_month(month_end)
-
-    expense_accounts = book.find_account("Expenses")
-    expenses = 0
-    for account in expense_accounts.children:
-        if account.name not in EXEMPT_EXPENSE_ACCOUNTS:
-            for split in account.get_all_splits():
-                if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-                    expenses += split.value
-
-    return expenses * -1
-
-
-def get_income_for_month(book, month_end):
-    end_date = month_end
-    start_date = subtract_month(month_end)
-
-    expense_accounts = book.find_account("Income")
-    expenses = 0
-    for account in expense_accounts.children:
-        if account.name not in EXEMPT_EXPENSE_ACCOUNTS:
-            for split in account.get_all_splits():
-                if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-                    expenses += split.value
-
-    return expenses * -1
-
-
-def get_rent_expenses_for_month(book, month_end):
-    end_date = month_end
-    start_date = subtract_month(month_end)
-
-    expense_accounts = book.find_account("Expenses")
-    expenses = 0
-    for account in expense_accounts.children:
-        if account.name == "Rent":
-            for split in account.splits:
-                if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-                    expenses += split.value
-
-    return expenses * -1
-
-
-def get_historical_rent_expenses_average(book, start, today):
-    rent = 0
-    months = 0
-    for month in report_days(start, today):
-        rent += get_rent_expenses_for_month(book, month)
-        months += 1
-
-    return rent / months
-
-
-def get_food_expenses_for_month(book, month_end):
-    end_date = month_end
-    start_date = subtract_month(month_end)
-
-    expense_accounts = book.find_account("Groceries")
+def get_rent_expenses_for_month(classifier, month_end):
     expenses = 0
-    for split in expense_accounts.get_all_splits():
-        if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-            expenses += split.value
+    for account in classifier.accounts(classify.RENT):
+        expenses += classifier.ledger.total(account, month_end, subtree=False)
 
     return expenses * -1
 
 
-def get_food_donations_for_month(book, month_end):
-    end_date = month_end
-    start_date = subtract_month(month_end)
-
-    food_donations = book.find_account("Food and Drink Donations")
-    donations = 0
-    for split in food_donations.get_all_splits():
-        if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-            donations += split.value
-
-    return donations * -1
-
-
-def get_donating_members(book, month_end):
-    end_date = month_end
-    start_date = subtract_month(month_end)
-
-    member_dues = book.find_account("Regular donations")
-    members = 0
-    for split in member_dues.get_all_splits():
-        if start_date < split.transaction.date.replace(tzinfo=None) <= end_date:
-            members += len(split.transaction.splits) - 1
-
-    return members
+def report_days(start_date, end_date):
+    return iter(CALENDAR.closes(start_date, end_date))
 
 
-def subtract_month(date):
-    month = date.month - 2
-    month = month % 12 + 1
-    year = date.year
-    if month > date.month:
-        year = date.year - 1
-    day = min(date.day, calendar.monthrange(year, month)[1])
-    return datetime(year, month, day)
+def get_projection_value(classifier, data_point, name):
+    # A month's value in each projection series. Rent is taken out of the
+    # expenses projection since the projection adds the rent booked for each
+    # future month, so it is projected alongside expenses with the same model
+    if name == 'income':
+        return data_point[DUES] + data_point[DONATIONS]
+    if name == 'rent':
+        return get_rent_expenses_for_month(classifier, data_point[DATE])
+    return data_point[PROJECTION_SERIES_COLUMNS[name]]
 
 
-def add_month(date):
-    month = date.month
-    month = month % 12 + 1
-    year = date.year
-    if month < date.month:
-        year = date.year + 1
-    day = min(date.day, calendar.monthrange(year, month)[1])
-    return datetime(year, month, day)
+def get_projection_series(classifier, history, names):
+    return dict((name, [get_projection_value(classifier, data_point, name) for data_point in history])
+                for name in names)
 
 
-def report_days(start_date, end_date):
-    delta = relativedelta(months=+1)
-    d = start_date.replace(day=MONTH_START_DAY)
-    while d < end_date.replace(day=MONTH_START_DAY):
-        d += delta
-        yield d
+def get_projection_models(models, names):
+    return dict((name, projection.create(models['expenses' if name == 'rent' else name])) for name in names)
 
 
-def get_historical_membership_income_average(book, start, today):
-    income = 0
-    months = 0
-    for month in report_days(start, today):
-        income += get_dues_for_month(book, month) + get_donations_for_month(book, month)
-        months += 1
+def get_fitted_projections(classifier, history, models, names):
+    # The named projection models, fed every history row
+    projections = get_projection_models(models, names)
+    for data_point in history:
+        for name, model in projections.items():
+            model.add(get_projection_value(classifier, data_point, name))
+    return projections
 
-    return income / months
 
+def get_projected_income(projections, step):
+    return projections['income'].forecast(step)
 
-def get_projected_income(history):
-    return history[-1][DUES] + history[-1][DONATIONS]
 
+def get_projected_expenses(projections, step):
+    return projections['expenses'].forecast(step) * -1 - projections['rent'].forecast(step)
 
-def get_projected_expenses(history):
-    expenses = 0
-    for data_point in history:
-        expenses += data_point[EXPENSES]
 
-    return expenses / len(history) * -1
+def get_columns(text):
+    # -l "Capital,Expenses" -> the column names, checked
+    columns = [column.strip() for column in text.split(',')]
+    for column in columns:
+        if column == DATE or column not in get_fieldnames(True):
+            raise ValueError("Unknown column: {}".format(column))
+    return columns
 
 
-def get_projected_food_income(history):
-    income = 0
-    for data_point in history:
-        income += data_point[FOOD_DONATIONS]
+def quiet(*args):
+    pass
 
-    return income / len(history)
 
+def get_backtest_models(models):
+    return projection.BACKTEST_MODELS + sorted(set(models.values()) - set(projection.BACKTEST_MODELS))
 
-def get_projected_food_expenses(history):
-    expenses = 0
-    for data_point in history:
-        expenses += data_point[FOOD_EXPENSES]
 
-    return expenses / len(history)
+def write_backtest(scores):
+    print("{:<18} {:<14} {:>6} {:>14}".format("Column", "Model", "Months", "Mean abs error"))
+    for column, spec, months, error in scores:
+        print("{:<18} {:<14} {:>6} {:>14}".format(column, spec, months,
+                                                  "{:.2f}".format(error) if error is not None else "-"))
 
 
 if __name__ == "__main__":
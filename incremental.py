@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import pickle
+import outputs
+
+
+# Saved per-period results from a previous forecast run. Each period is
+# stored with the ledger's summary of it (split count and total per account),
+# and the run records a watermark (date and GUID of the latest transaction it
+# saw). On the next run every period from the first one that has new or edited
+# transactions onwards is recomputed; earlier periods are reused as they are.
+# The summaries come from the ledger's index, so checking a period costs about
+# the same whatever it holds, and the check stops at the first changed one.
+#
+# Later periods are always recomputed together with a changed one because
+# new/lost members compare each period with the one before it.
+#
+# A state without a filename is never read or written, it only lives as long
+# as the process does.
+
+STATE_VERSION = 3
+
+
+def watermark(book):
+    if hasattr(book, 'latest_transaction'):
+        return book.latest_transaction()
+
+    latest = None
+    for transaction in book.transactions:
+        date = transaction.date.replace(tzinfo=None)
+        if latest is None or (date, transaction.guid) > latest:
+            latest = (date, transaction.guid)
+    return latest
+
+
+class ForecastState(object):
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.key = (STATE_VERSION, key)
+        self.watermark = None
+        self.periods = {}
+        self.changed = False
+
+        if filename is not None and os.path.exists(filename):
+            with open(filename, 'rb') as state_file:
+                state = pickle.load(state_file)
+            if state['key'] == self.key:
+                self.watermark = state['watermark']
+                self.periods = state['periods']
+            else:
+                print("Forecast state in", filename, "was saved with different settings, recomputing everything")
+
+    def stale_months(self, ledger, months):
+        stale_from = len(months)
+
+        if self.watermark is not None:
+            latest_period = ledger.period_end(self.watermark[0])
+            for index, month in enumerate(months):
+                if month >= latest_period:
+                    stale_from = index
+                    break
+
+        for index, month in enumerate(months[:stale_from]):
+            saved = self.periods.get(month)
+            if saved is None or saved[0] != ledger.period_summary(month):
+                stale_from = index
+                break
+
+        return months[stale_from:]
+
+    def totals(self, month_end):
+        return dict(self.periods[month_end][1])
+
+    def update(self, ledger, month_end, totals):
+        period = (ledger.period_summary(month_end), dict(totals))
+        if self.periods.get(month_end) != period:
+            self.periods[month_end] = period
+            self.changed = True
+
+    def save(self, book):
+        # Nothing to write when the recomputed periods came out as saved
+        latest = watermark(book)
+        if not self.changed and latest == self.watermark:
+            return
+        self.watermark = latest
+        self.changed = False
+        if self.filename is None:
+            return
+
+        def write_state(temp_path):
+            with open(temp_path, 'wb') as state_file:
+                pickle.dump({'key': self.key, 'watermark': self.watermark, 'periods': self.periods},
+                            state_file, pickle.HIGHEST_PROTOCOL)
+
+        outputs.replace_file(self.filename, write_state)
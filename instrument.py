@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import sys
+import json
+import time
+import functools
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Opt-in timing for the report scripts. A script marks the start of each
+# stage with stage(), and wrap() swaps a module's functions for counting,
+# timing copies so calls made through the module's globals are picked up too.
+# When a ledger is attached, the splits each stage and function scanned are
+# recorded from its counter.
+#
+# Function times are inclusive: a getter calling another getter counts the
+# inner call's time in both.
+
+
+class Instruments(object):
+    def __init__(self):
+        self.ledger = None
+        self._stages = []
+        self._current = None
+        self._functions = {}
+        self._wrapped = []
+
+    def _scanned(self):
+        return self.ledger.scanned if self.ledger is not None else 0
+
+    def stage(self, name):
+        # Starts timing a stage, ending the one before it
+        self.stop()
+        self._current = (name, time.time(), self._scanned())
+
+    def stop(self):
+        if self._current is not None:
+            name, started, scanned = self._current
+            self._stages.append((name, time.time() - started, self._scanned() - scanned))
+            self._current = None
+
+    def wrap(self, module, names):
+        for name in names:
+            function = getattr(module, name)
+            self._wrapped.append((module, name, function))
+            setattr(module, name, self._timed(name, function))
+
+    def restore(self):
+        for module, name, function in reversed(self._wrapped):
+            setattr(module, name, function)
+        self._wrapped = []
+
+    def _timed(self, name, function):
+        record = self._functions.setdefault(name, {'calls': 0, 'seconds': 0.0, 'splits_scanned': 0})
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            started = time.time()
+            scanned = self._scanned()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record['calls'] += 1
+                record['seconds'] += time.time() - started
+                record['splits_scanned'] += self._scanned() - scanned
+
+        return timed
+
+    def summary(self):
+        return {
+            'stages': [{'stage': name, 'seconds': seconds, 'splits_scanned': scanned}
+                       for name, seconds, scanned in self._stages],
+            'functions': dict((name, record) for name, record in self._functions.items() if record['calls']),
+            'splits_scanned': self._scanned(),
+            'peak_memory_kb': peak_memory_kb(),
+        }
+
+    def write(self, filename):
+        with open(filename, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=2, sort_keys=True)
+
+
+def peak_memory_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
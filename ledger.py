@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import zlib
+from bisect import bisect_right
+from periods import PeriodCalendar
+
+
+class Ledger(object):
+    # Index of every split in a book, bucketed once by account path and by
+    # reporting period so the monthly report getters don't rescan accounts.
+    #
+    # A reporting period is identified by the date it closes on (the same
+    # dates report_days() yields) and covers (previous close, close].
+    #
+    # scanned counts the splits visited while indexing and answering queries,
+    # for instrument.py.
+
+    def __init__(self, book, month_start_day):
+        self.book = book
+        self.month_start_day = month_start_day
+        self.calendar = PeriodCalendar(month_start_day)
+
+        self._accounts = {}
+        self._paths = {}
+        self._dates = {}
+        self._periods = {}
+        self._splits = {}
+        self._subtree_splits = {}
+        self._totals = {}
+        self._timelines = {}
+        self.scanned = 0
+
+        for account, children, splits in book.root_account.walk():
+            path = self.path(account)
+            ancestors = self._ancestor_paths(account)
+            self.scanned += len(splits)
+
+            for split in splits:
+                period = self.calendar.end(self.period_index(split))
+
+                self._add(self._splits, path, period, split)
+                for ancestor in ancestors:
+                    self._add(self._subtree_splits, ancestor, period, split)
+
+    def _add(self, split_index, path, period, split):
+        periods = split_index.setdefault(path, {})
+        periods.setdefault(period, []).append(split)
+
+    def _timeline(self, account, subtree):
+        # Date-sorted split dates with the running balance after each one
+        key = (self.path(account), subtree)
+        if key not in self._timelines:
+            index = self._subtree_splits if subtree else self._splits
+            entries = []
+            for splits in index.get(key[0], {}).values():
+                entries.extend((self.date(split), split.value) for split in splits)
+            entries.sort(key=lambda entry: entry[0])
+            self.scanned += len(entries)
+
+            dates = []
+            balances = []
+            balance = 0
+            for date, value in entries:
+                balance += value
+                dates.append(date)
+                balances.append(balance)
+
+            self._timelines[key] = (dates, balances)
+        return self._timelines[key]
+
+    def _ancestor_paths(self, account):
+        paths = []
+        while account is not None:
+            paths.append(self.path(account))
+            account = account.parent
+        return paths
+
+    def account(self, name):
+        if name not in self._accounts:
+            self._accounts[name] = self.book.find_account(name)
+        return self._accounts[name]
+
+    def path(self, account):
+        key = account.guid
+        if key not in self._paths:
+            if account.parent is None:
+                self._paths[key] = account.name
+            else:
+                self._paths[key] = self.path(account.parent) + ":" + account.name
+        return self._paths[key]
+
+    def date(self, split):
+        transaction = split.transaction
+        key = transaction.guid
+        if key not in self._dates:
+            self._dates[key] = transaction.date.replace(tzinfo=None)
+        return self._dates[key]
+
+    def period_index(self, split):
+        # The split's period number in self.calendar, worked out once per transaction
+        key = split.transaction.guid
+        if key not in self._periods:
+            self._periods[key] = self.calendar.index(self.date(split))
+        return self._periods[key]
+
+    def period_end(self, date):
+        return self.calendar.end(self.calendar.index(date))
+
+    def period_start(self, month_end):
+        return self.calendar.end(self.calendar.index(month_end) - 1)
+
+    def splits(self, account, month_end, subtree=True):
+        index = self._subtree_splits if subtree else self._splits
+        splits = index.get(self.path(account), {}).get(month_end, [])
+        self.scanned += len(splits)
+        return splits
+
+    def total(self, account, month_end, subtree=True):
+        return self._total(self.path(account), month_end, subtree)
+
+    def _total(self, path, month_end, subtree):
+        # Summed on first use in indexing order, so the Decimal is the same as
+        # adding the splits up while indexing; most paths are never asked for
+        key = (path, month_end, subtree)
+        if key not in self._totals:
+            index = self._subtree_splits if subtree else self._splits
+            total = 0
+            for split in index.get(path, {}).get(month_end, []):
+                total += split.value
+            self._totals[key] = total
+        return self._totals[key]
+
+    def period_summary(self, month_end):
+        # (path, split count, checksum of the split values) of every account
+        # with splits in the period, enough to tell whether any were added,
+        # removed or changed without adding up Decimals
+        summary = []
+        for path, periods in self._splits.items():
+            splits = periods.get(month_end)
+            if splits:
+                values = ' '.join(str(split.value) for split in splits)
+                summary.append((path, len(splits), zlib.crc32(values.encode('ascii')) & 0xffffffff))
+        return sorted(summary)
+
+    def balance(self, account, date, subtree=True):
+        dates, balances = self._timeline(account, subtree)
+        position = bisect_right(dates, date)
+        if position == 0:
+            return 0
+        return balances[position - 1]
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import re
+import json
+
+
+# Member records shared by members.py and emails.py. A member's balance and
+# email address are worked out once, when the record is built, instead of on
+# every call.
+#
+# Extra membership tiers can be loaded from a JSON list, e.g.
+#
+#     [{"account": "Family Members", "type": "Family", "monthly_dues": 60}]
+
+EMAIL_PATTERN = re.compile(r"[^@ ]+@[^@ ]+\.[^@ ]+")
+
+
+class Member(object):
+    __slots__ = ('account', '_name', '_balance', '_email')
+
+    monthy_dues = 40
+    membership_type = "Regular"
+
+    def __init__(self, account):
+        self.account = account
+        self._name = account.name
+        self._balance = sum((-1 * split.value) for split in account.splits)
+
+        email = EMAIL_PATTERN.search(account.description or "")
+        self._email = email.group() if email is not None else None
+
+    def type(self):
+        return self.membership_type
+
+    def name(self):
+        return self._name
+
+    def balance(self):
+        return self._balance
+
+    def effective_balance(self):
+        return self._balance - self.monthy_dues
+
+    def email(self):
+        return self._email
+
+
+class StudentMember(Member):
+    __slots__ = ()
+
+    monthy_dues = 20
+    membership_type = "Student"
+
+
+# Tiers are (account name, member class) pairs, each account under Active Members
+DEFAULT_TIERS = [
+    ("Full Members", Member),
+    ("Student Members", StudentMember),
+]
+
+
+def tier(membership_type, monthly_dues):
+    return type(str(membership_type + "Member"), (Member,), {
+        '__slots__': (),
+        'monthy_dues': monthly_dues,
+        'membership_type': membership_type,
+    })
+
+
+def load_tiers(filename):
+    with open(filename) as tiers_file:
+        extra_tiers = json.load(tiers_file)
+
+    tiers = list(DEFAULT_TIERS)
+    for extra_tier in extra_tiers:
+        tiers.append((extra_tier['account'], tier(extra_tier['type'], extra_tier['monthly_dues'])))
+
+    return tiers
+
+
+def load_members(book, tiers=DEFAULT_TIERS):
+    active_member_accounts = book.find_account("Active Members")
+
+    members = []
+    for account_name, member_class in tiers:
+        tier_account = active_member_accounts.find_account(account_name)
+        if tier_account is None:
+            print("ERROR: no", account_name, "account under Active Members")
+            continue
+
+        for account in tier_account.children:
+            members.append(member_class(account))
+
+    return members
+
+
+def get_aging(ledger, members, months):
+    # Each member's balance at the close of every reporting period, read from
+    # the ledger's per-account running balances with a binary search per month
+    return [[0 - ledger.balance(member.account, month, subtree=False) for month in months] for member in members]
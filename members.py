@@ -2,10 +2,14 @@
 
 from __future__ import print_function
 import sys
-import gnucashxml
+import bookcache
+import compactbook
 import getopt
 import csv
-import re
+import outputs
+from dateutil.relativedelta import relativedelta
+from member import DEFAULT_TIERS, load_members, load_tiers, get_aging
+from forecast import MONTH_START_DAY, report_days, report_today
 
 
 DATE = 'Date'
@@ -16,28 +20,36 @@ NAME = 'Name'
 EMAIL = 'Email address'
 ACCOUNT_BALANCE = 'Account balance'
 MEMBERSHIP_TYPE = 'Membership type'
+MONTHS_IN_ARREARS = 'Months in arrears'
 
 
 def main(argv):
     try:
-        opts, args = getopt.getopt(argv, "a:b:c:")
+        opts, args = getopt.getopt(argv, "a:b:c:g:kt:")
     except getopt.GetoptError:
         print("argument error")
         sys.exit(2)
 
-    filename = args[0]
-    book = gnucashxml.from_filename(filename)
+    tiers = DEFAULT_TIERS
+    aging_months = None
+    compact = False
 
-    active_members = []
+    for opt, arg in opts:
+        if opt == '-g':
+            aging_months = int(arg)
+        elif opt == '-k':
+            compact = True
+        elif opt == '-t':
+            tiers = load_tiers(arg)
 
-    active_member_accounts = book.find_account("Active Members")
-    for account in active_member_accounts.find_account("Full Members").children:
-        member = Member(account)
-        active_members.append(member)
+    filename = args[0]
+    # -k keeps the book in compact arrays instead of objects, see compactbook.py
+    if compact:
+        book = compactbook.load([filename], ["Active Members"])
+    else:
+        book = bookcache.load(filename, ["Active Members"])
 
-    for account in active_member_accounts.find_account("Student Members").children:
-        member = StudentMember(account)
-        active_members.append(member)
+    active_members = load_members(book, tiers)
 
     with open('members.csv', 'wb') as csvfile:
         fieldnames = [
@@ -52,48 +64,60 @@ def main(argv):
         writer.writeheader()
 
         for member in active_members:
-            writer.writerow({
-                NAME: member.name(),
-                EMAIL: member.email(),
-                MEMBERSHIP_TYPE: member.type(),
-                ACCOUNT_BALANCE: member.effective_balance()
-            })
+            writer.writerow(get_member_row(member))
             print(member.name(), "has a balance of", "$" + str(member.effective_balance()), "   ", member.email())
 
             if member.email() == None:
                 print("ERROR:", member.name(), "does not have an email address on record")
 
 
-class Member(object):
-    monthy_dues = 40
-    membership_type = "Regular"
+    if aging_months:
+        write_aging_report(book, active_members, aging_months)
+
+
+def get_member_row(member):
+    return {
+        NAME: member.name(),
+        EMAIL: member.email(),
+        MEMBERSHIP_TYPE: member.type(),
+        ACCOUNT_BALANCE: outputs.money(member.effective_balance())
+    }
+
 
-    def __init__(self, account):
-        self.account = account
+def get_aging_report(ledger, active_members, months_back):
+    today = report_today()
+    months = list(report_days(today - relativedelta(months=+months_back), today))
 
-    def type(self):
-        return self.membership_type
+    month_names = [str(month.date()) for month in months]
+    fieldnames = [
+        NAME,
+        MEMBERSHIP_TYPE,
+        MONTHS_IN_ARREARS,
+    ] + month_names
 
-    def name(self):
-        return self.account.name
+    rows = []
+    for member, balances in zip(active_members, get_aging(ledger, active_members, months)):
+        row = dict(zip(month_names, [outputs.money(balance) for balance in balances]))
+        row[NAME] = member.name()
+        row[MEMBERSHIP_TYPE] = member.type()
+        row[MONTHS_IN_ARREARS] = sum(1 for balance in balances if balance < 0)
+        rows.append(row)
 
-    def balance(self):
-        return sum((-1 * split.value) for split in self.account.splits)
+    return fieldnames, rows
 
-    def effective_balance(self):
-        return self.balance() - self.monthy_dues
 
-    def email(self):
-        email = re.search("[^@ ]+@[^@ ]+\.[^@ ]+", self.account.description)
-        if email is None:
-            return None
-        else:
-            return email.group()
+def write_aging_report(book, active_members, months_back):
+    fieldnames, rows = get_aging_report(compactbook.open_ledger(book, MONTH_START_DAY), active_members, months_back)
+
+    with open('aging.csv', 'wb') as csvfile:
+        writer = csv.DictWriter(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL, fieldnames=fieldnames)
+
+        writer.writeheader()
 
+        for row in rows:
+            writer.writerow(row)
 
-class StudentMember(Member):
-    monthy_dues = 20
-    membership_type = "Student"
+    print("Wrote balances for", len(rows), "members over", len(fieldnames) - 3, "months to aging.csv")
 
 
 if __name__ == "__main__":
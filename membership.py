@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+
+class Membership(object):
+    # Which member accounts paid dues in each reporting period. A member
+    # "pays" in a period when their account shares a transaction with a dues
+    # split posted in that period. Each period is worked out from the
+    # ledger's splits of the dues account the first time it is asked about,
+    # so forecasts that need no member columns never look at them, and a
+    # database ledger (see booksql.py) only reads the periods reported on.
+
+    def __init__(self, ledger, dues_account_name="Member Dues"):
+        self.ledger = ledger
+        self.dues_account_name = dues_account_name
+        self._dues_accounts = None
+        self._members = {}
+
+    def members(self, month_end):
+        if month_end not in self._members:
+            ledger = self.ledger
+            dues_account = ledger.account(self.dues_account_name)
+            if self._dues_accounts is None:
+                self._dues_accounts = set(account.guid for account, children, splits in dues_account.walk())
+
+            # Members are known by account name, so a member whose account moves
+            # to another tier is neither new nor lost
+            members = set()
+            for split in ledger.splits(dues_account, month_end):
+                for subsplit in split.transaction.splits:
+                    if subsplit.account.guid not in self._dues_accounts:
+                        members.add(subsplit.account.name)
+            self._members[month_end] = members
+
+        return set(self._members[month_end])
+
+    def new_members(self, month_end):
+        return self.members(month_end) - self.members(self.ledger.period_start(month_end))
+
+    def lost_members(self, month_end):
+        return self.members(self.ledger.period_start(month_end)) - self.members(month_end)
+
+    def churn(self, month_end):
+        previous = self.members(self.ledger.period_start(month_end))
+        if not previous:
+            return 0
+        return float(len(self.lost_members(month_end))) / len(previous)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import random
+from decimal import Decimal
+
+
+# Monte Carlo runway simulation. Each simulated month draws a whole
+# historical month at random (a bootstrap, so dues, donations, expenses and
+# food profit that tend to move together stay together) and adds its net
+# change plus the known rent for that month to every path.
+#
+# Paths are advanced a month at a time over the whole batch, and floats are
+# used throughout: the result is a distribution, not an account balance. The
+# percentile capitals are only rounded to Decimal cents when they are reported.
+
+PERCENTILES = (5, 50, 95)
+CENT = Decimal('0.01')
+
+
+def simulate(capital, samples, rent, targets, paths=10000, seed=None):
+    # samples: net monthly change of each historical month, excluding rent
+    # rent, targets: rent and capital target for each projected month
+    generator = random.Random(seed)
+    draw = generator.random
+    samples = [float(sample) for sample in samples]
+    count = len(samples)
+
+    balances = [float(capital)] * paths
+    dropped = [False] * paths
+    results = []
+
+    for month_rent, target in zip(rent, targets):
+        month_rent = float(month_rent)
+        target = float(target)
+
+        balances = [balance + samples[int(draw() * count)] + month_rent for balance in balances]
+        below = [balance < target for balance in balances]
+        dropped = [was_below or is_below for was_below, is_below in zip(dropped, below)]
+
+        ordered = sorted(balances)
+        results.append({
+            'percentiles': dict((percentile, _percentile(ordered, percentile)) for percentile in PERCENTILES),
+            'below_target': float(sum(below)) / paths,
+            'dropped_below_target': float(sum(dropped)) / paths,
+        })
+
+    return results
+
+
+def _percentile(ordered, percentile):
+    # Nearest rank
+    index = int(round(percentile / 100.0 * (len(ordered) - 1)))
+    return Decimal(ordered[index]).quantize(CENT)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import sys
+import errno
+import csv
+import json
+import numbers
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+
+
+# Report table outputs. Each output writes a list of row dicts under the given
+# fieldnames for one run, identified by the time the run started.
+#
+# csv:PATH replaces PATH with the latest run, like forecast.csv always has.
+# sqlite:PATH appends the run to a table in a SQLite database, keyed by run
+# and date, so years of runs can be queried without re-parsing CSV text.
+# Columns get their type from the values written: DATE (ISO dates), INTEGER,
+# DECIMAL for amounts and REAL. New columns, e.g. the simulation columns, are
+# added to an existing table as they appear.
+#
+# Both are written atomically: the CSV through a temporary file that replaces
+# the old one (see replace_file(), which the book cache, the forecast state and
+# mbox outboxes are written with too), the database rows in a single
+# transaction.
+#
+# Streams (forecast.py -w FORMAT:PATH) instead write every row the moment it
+# is computed, to PATH or to stdout when PATH is "-", so long ranges are
+# never held in memory and a pipe can start on the first months right away:
+# csv:PATH as above, jsonl:PATH one JSON object per row, with dates as ISO
+# dates and amounts as decimal strings (see money()). jsonl:PATH is also an -o output.
+
+DEFAULT_TABLE = 'forecast'
+RUN = 'Run'
+
+
+class CsvOutput(object):
+    # Rows are only read once, so they can come from a generator
+    single_pass = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, fieldnames, rows, run):
+        def write_rows(temp_path):
+            with open(temp_path, 'wb') as csvfile:
+                writer = csv.DictWriter(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL,
+                                        fieldnames=fieldnames)
+
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+
+        replace_file(self.path, write_rows)
+
+
+def replace_file(path, write):
+    # Has write(temp_path) write a temporary file next to path, which then
+    # replaces path in one rename, so nothing ever reads a half-written file.
+    # The temporary file is removed if writing fails
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(handle)
+    try:
+        write(temp_path)
+        # mkstemp makes the file private, keep the mode the file had or a new file would get
+        os.chmod(temp_path, _file_mode(path))
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def _file_mode(path):
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+class SqliteOutput(object):
+    single_pass = False
+
+    def __init__(self, path, table=DEFAULT_TABLE):
+        self.path = path
+        self.table = table
+
+    def write(self, fieldnames, rows, run):
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                table_info = connection.execute('PRAGMA table_info({})'.format(_quote(self.table)))
+                existing = [column[1] for column in table_info]
+                if not existing:
+                    connection.execute('CREATE TABLE {} ({} TIMESTAMP NOT NULL, {}, PRIMARY KEY ({}, {}))'.format(
+                        _quote(self.table), _quote(RUN),
+                        ', '.join(_quote(name) + ' ' + column_type(name, rows) for name in fieldnames),
+                        _quote(RUN), _quote(fieldnames[0])))
+                else:
+                    for name in fieldnames:
+                        if name not in existing:
+                            connection.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                                _quote(self.table), _quote(name), column_type(name, rows)))
+
+                columns = [RUN] + list(fieldnames)
+                connection.executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+                    _quote(self.table), ', '.join(_quote(name) for name in columns), ', '.join('?' * len(columns))),
+                    [[str(run)] + [_value(row.get(name)) for name in fieldnames] for row in rows])
+        finally:
+            connection.close()
+
+
+class CsvStream(object):
+    single_pass = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, fieldnames, rows, run):
+        with _open_stream(self.path) as stream:
+            writer = csv.DictWriter(stream, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL,
+                                    fieldnames=fieldnames)
+
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                stream.flush()
+
+
+class JsonLinesOutput(object):
+    single_pass = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, fieldnames, rows, run):
+        with _open_stream(self.path) as stream:
+            for row in rows:
+                stream.write(json.dumps(OrderedDict((name, _value(row.get(name))) for name in fieldnames)))
+                stream.write('\n')
+                stream.flush()
+
+
+FORMATS = {
+    'csv': CsvOutput,
+    'jsonl': JsonLinesOutput,
+    'sqlite': SqliteOutput,
+}
+
+STREAMS = {
+    'csv': CsvStream,
+    'jsonl': JsonLinesOutput,
+}
+
+
+def open_output(spec, formats=FORMATS):
+    # spec is FORMAT:PATH, e.g. sqlite:forecasts.db
+    output_format, _, path = spec.partition(':')
+    if output_format not in formats or not path:
+        raise ValueError("Unknown output {}, expected one of {} followed by :PATH".format(
+            spec, ', '.join(sorted(formats))))
+    return formats[output_format](path)
+
+
+def open_stream(spec):
+    # spec is FORMAT:PATH, e.g. jsonl:- for JSON Lines on stdout
+    return open_output(spec, STREAMS)
+
+
+def is_stdout(output):
+    return getattr(output, 'path', None) == '-'
+
+
+def column_type(name, rows):
+    values = [row[name] for row in rows if row.get(name) is not None]
+    if not values:
+        return 'DECIMAL'
+    if any(isinstance(value, datetime) for value in values):
+        return 'DATE'
+    if any(isinstance(value, Decimal) for value in values):
+        return 'DECIMAL'
+    if any(isinstance(value, bool) or not isinstance(value, numbers.Real) for value in values):
+        return 'TEXT'
+    if all(isinstance(value, numbers.Integral) for value in values):
+        return 'INTEGER'
+    return 'REAL'
+
+
+def money(value):
+    # Amounts are Decimals, except a sum over nothing, which is the int 0. Without
+    # this a money column would mix decimal strings and numbers in JSON
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return Decimal(value)
+    return value
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class _Stdout(object):
+    # sys.stdout for a with statement, without closing it. A reader that stops
+    # early (e.g. head) just ends the stream
+    def __enter__(self):
+        return sys.stdout
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            sys.stdout.flush()
+        except (IOError, OSError) as error:
+            if error.errno != errno.EPIPE:
+                raise
+            exc_value = error
+        return isinstance(exc_value, (IOError, OSError)) and exc_value.errno == errno.EPIPE
+
+
+def _open_stream(path):
+    if path == '-':
+        return _Stdout()
+    return open(path, 'wb')
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import calendar
+from datetime import datetime
+
+
+# Reporting-period calendar. Periods close at midnight on month_start_day of
+# every month and cover (previous close, close]. Each period is numbered by
+# the month it closes in, counted from year 0 (year * 12 + month - 1), so
+# mapping a date to its period is a little integer arithmetic instead of
+# building and comparing datetimes, and neighbouring periods are just the
+# next and previous numbers.
+#
+# A month_start_day past the end of a short month closes on that month's
+# last day.
+
+
+class PeriodCalendar(object):
+    def __init__(self, month_start_day):
+        self.month_start_day = month_start_day
+        self._ends = {}
+
+    def _close_day(self, year, month):
+        if self.month_start_day <= 28:
+            return self.month_start_day
+        return min(self.month_start_day, calendar.monthrange(year, month)[1])
+
+    def index(self, date):
+        # Period containing date; a date on the closing day but after midnight
+        # belongs to the next period
+        index = date.year * 12 + date.month - 1
+        day = self._close_day(date.year, date.month)
+        if date.day > day or (date.day == day and (date.hour or date.minute or date.second or date.microsecond)):
+            index += 1
+        return index
+
+    def end(self, index):
+        if index not in self._ends:
+            year, month = divmod(index, 12)
+            self._ends[index] = datetime(year, month + 1, self._close_day(year, month + 1))
+        return self._ends[index]
+
+    def month_index(self, date):
+        return date.year * 12 + date.month - 1
+
+    def closes(self, start_date, end_date):
+        # Period ends after start_date's month up to and including end_date's month,
+        # like report_days()
+        return [self.end(index) for index in range(self.month_index(start_date) + 1, self.month_index(end_date) + 1)]
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from collections import deque
+from decimal import Decimal, InvalidOperation
+
+
+# Projection models for the forecast columns. Each model is fed a column's
+# monthly history one month at a time and keeps only running sums (or a
+# window of at most a year), so adding a month costs the same however long
+# the history is. forecast(steps) projects the value the given number of
+# months after the last one added.
+#
+# Models are chosen per column with specs like "rolling:6" or "ewma:0.3":
+#
+#     last          the last month, carried forward
+#     mean          the mean over the whole history
+#     rolling:N     the mean over the last N months (default 3)
+#     ewma:ALPHA    exponentially weighted mean, ALPHA the weight of the newest month (default 0.5)
+#     trend         least squares line through the history, extended
+#     seasonal:N    the same month one season (default 12 months) earlier, or the mean until
+#                   a whole season is known
+#
+# Decimal arithmetic is used throughout, so last and mean give exactly the
+# amounts the forecast always used.
+
+DEFAULT_WINDOW = 3
+DEFAULT_ALPHA = Decimal('0.5')
+DEFAULT_SEASON = 12
+
+BACKTEST_MODELS = ['last', 'mean', 'rolling:3', 'rolling:6', 'ewma:0.3', 'ewma:0.6', 'trend', 'seasonal']
+
+
+class Last(object):
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        self.value = value
+
+    def forecast(self, steps=1):
+        return self.value
+
+
+class Mean(object):
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        self.total += value
+        self.count += 1
+
+    def forecast(self, steps=1):
+        # Counts are ints, which Python 2 would floor-divide
+        return Decimal(self.total) / self.count
+
+
+class Rolling(object):
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.values = deque()
+        self.window = window
+        self.total = 0
+
+    def add(self, value):
+        self.values.append(value)
+        self.total += value
+        if len(self.values) > self.window:
+            self.total -= self.values.popleft()
+
+    def forecast(self, steps=1):
+        return Decimal(self.total) / len(self.values)
+
+
+class Ewma(object):
+    def __init__(self, alpha=DEFAULT_ALPHA):
+        self.alpha = alpha
+        self.level = None
+
+    def add(self, value):
+        if self.level is None:
+            self.level = value
+        else:
+            self.level = self.alpha * value + (1 - self.alpha) * self.level
+
+    def forecast(self, steps=1):
+        return self.level
+
+
+class Trend(object):
+    # Months are numbered 0, 1, 2, ... in the order they are added
+    def __init__(self):
+        self.count = 0
+        self.sum_x = 0
+        self.sum_y = 0
+        self.sum_xx = 0
+        self.sum_xy = 0
+
+    def add(self, value):
+        x = self.count
+        self.count += 1
+        self.sum_x += x
+        self.sum_y += value
+        self.sum_xx += x * x
+        self.sum_xy += x * value
+
+    def forecast(self, steps=1):
+        slope = 0
+        spread = self.count * self.sum_xx - self.sum_x * self.sum_x
+        if spread:
+            slope = Decimal(self.count * self.sum_xy - self.sum_x * self.sum_y) / spread
+        intercept = (Decimal(self.sum_y) - slope * self.sum_x) / self.count
+        return intercept + slope * (self.count - 1 + steps)
+
+
+class Seasonal(object):
+    def __init__(self, season=DEFAULT_SEASON):
+        self.values = deque(maxlen=season)
+        self.season = season
+        self.mean = Mean()
+
+    def add(self, value):
+        self.values.append(value)
+        self.mean.add(value)
+
+    def forecast(self, steps=1):
+        if len(self.values) < self.season:
+            return self.mean.forecast(steps)
+        return self.values[(steps - 1) % self.season]
+
+
+def _positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise ValueError
+    return value
+
+
+def _alpha(text):
+    value = Decimal(text)
+    if not 0 < value <= 1:
+        raise ValueError
+    return value
+
+
+# name: (model class, parameter parser or None when it takes no parameter)
+MODELS = {
+    'last': (Last, None),
+    'mean': (Mean, None),
+    'rolling': (Rolling, _positive_int),
+    'ewma': (Ewma, _alpha),
+    'trend': (Trend, None),
+    'seasonal': (Seasonal, _positive_int),
+}
+
+
+def create(spec):
+    name, separator, parameter = spec.partition(':')
+    if name not in MODELS:
+        raise ValueError("Unknown projection model: {}".format(spec))
+
+    model, parse = MODELS[name]
+    if not separator:
+        return model()
+    if parse is None:
+        raise ValueError("Projection model {} takes no parameter".format(name))
+    try:
+        return model(parse(parameter))
+    except (ValueError, InvalidOperation):
+        raise ValueError("Bad parameter for projection model: {}".format(spec))
+
+
+def fit(spec, values):
+    model = create(spec)
+    for value in values:
+        model.add(value)
+    return model
+
+
+def parse_models(text, models):
+    # "dues=ewma:0.3,expenses=trend" -> a copy of models with those columns changed
+    models = dict(models)
+    for item in text.split(','):
+        column, separator, spec = item.partition('=')
+        column = column.strip()
+        if not separator or column not in models:
+            raise ValueError("Unknown projected column: {}".format(column))
+        create(spec.strip())
+        models[column] = spec.strip()
+    return models
+
+
+def backtest(series, specs):
+    # Scores every model on every column by its one month ahead error over
+    # the history, in a single pass over the months. Returns rows of
+    # (column, spec, months scored, mean absolute error), best model first
+    # for each column
+    models = dict((column, [create(spec) for spec in specs]) for column in series)
+    errors = dict((column, [0] * len(specs)) for column in series)
+    scored = dict((column, 0) for column in series)
+
+    for month in range(max(len(values) for values in series.values()) if series else 0):
+        for column, values in series.items():
+            if month >= len(values):
+                continue
+            value = values[month]
+            if month > 0:
+                scored[column] += 1
+                for number, model in enumerate(models[column]):
+                    errors[column][number] += abs(model.forecast(1) - value)
+            for model in models[column]:
+                model.add(value)
+
+    results = []
+    for column in sorted(series):
+        rows = []
+        for spec, error in zip(specs, errors[column]):
+            rows.append((column, spec, scored[column], error / scored[column] if scored[column] else None))
+        results.extend(sorted(rows, key=lambda row: (row[3] is None, row[3])))
+    return results
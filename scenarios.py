@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import sys
+import csv
+import json
+import getopt
+import multiprocessing
+from decimal import Decimal
+from dateutil.relativedelta import relativedelta
+import compactbook
+import forecast
+from forecast import (DATE, CAPITAL, DUES, DONATIONS, FOOD_DONATIONS, FOOD_EXPENSES, EXPENSES, MEMBERS,
+                      DONATING_MEMBERS, PROJECTED_CAPITAL, PROJECTED_DUES, PROJECTED_DONATIONS, PROJECTED_MEMBERS,
+                      PROJECTED_DONATING_MEMBERS, PROJECTED_FOOD_DONATIONS, PROJECTED_FOOD_EXPENSES, CAPITAL_TARGET,
+                      FOOD_PROFIT)
+from membership import Membership
+from classify import AccountClassifier
+import classify
+import projection
+from member import Member
+
+
+# What-if projections. The history is summarised once into a baseline of
+# plain values: forecast.py's projection models (see -f there) are fed the
+# history and their forecast for every future month is kept. The baseline is
+# handed read-only to a pool of worker processes that each project one
+# scenario at a time.
+#
+# Scenarios are read from a JSON object mapping scenario names to parameter
+# overrides, e.g.
+#
+#     {"growth": {"member_growth": 0.02}, "dues 50": {"monthly_dues": 50, "rent_increase": 0.1}}
+#
+# member_growth is a monthly rate that compounds, monthly_dues replaces
+# Member.monthy_dues, rent_increase scales future rent and event_spending is
+# an extra amount spent every month.
+#
+#     scenarios.py [-c MONTHS] [-f COLUMN=MODEL,...] [-k] BOOK... SCENARIOS.json
+
+SCENARIO = 'Scenario'
+BASELINE_SCENARIO = 'baseline'
+
+DEFAULT_PARAMETERS = {
+    'member_growth': 0,
+    'monthly_dues': Member.monthy_dues,
+    'rent_increase': 0,
+    'event_spending': 0,
+}
+
+FIELDNAMES = [
+    SCENARIO,
+    DATE,
+    PROJECTED_CAPITAL,
+    PROJECTED_DUES,
+    PROJECTED_DONATIONS,
+    PROJECTED_MEMBERS,
+    PROJECTED_DONATING_MEMBERS,
+    PROJECTED_FOOD_DONATIONS,
+    PROJECTED_FOOD_EXPENSES,
+    CAPITAL_TARGET,
+    FOOD_PROFIT,
+]
+
+# History columns the projections are fed from, and the projections kept for each month
+BASELINE_COLUMNS = [CAPITAL, DUES, DONATIONS, MEMBERS, DONATING_MEMBERS, EXPENSES, FOOD_DONATIONS, FOOD_EXPENSES]
+PROJECTION_NAMES = ['income', 'expenses', 'rent', 'dues', 'donations', 'members', 'donating-members',
+                    'food-donations', 'food-expenses']
+
+_baseline = None
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "a:b:c:f:j:ko:r:")
+    except getopt.GetoptError:
+        print("argument error")
+        sys.exit(2)
+
+    months_after = months_before = months_context = None
+    rules = forecast.DEFAULT_ACCOUNT_RULES
+    models = forecast.DEFAULT_PROJECTION_MODELS
+    jobs = None
+    compact = False
+    output = 'scenarios.csv'
+
+    for opt, arg in opts:
+        if opt == '-a':
+            months_after = int(arg)
+        elif opt == '-b':
+            months_before = int(arg)
+        elif opt == '-c':
+            months_context = int(arg)
+        elif opt == '-f':
+            models = projection.parse_models(arg, models)
+        elif opt == '-j':
+            jobs = int(arg)
+        elif opt == '-k':
+            compact = True
+        elif opt == '-o':
+            output = arg
+        elif opt == '-r':
+            rules = classify.load_rules(arg)
+
+    future = months_after if months_after else months_context if months_context else forecast.DEFAULT_MONTHS
+    past = months_before if months_before else months_context if months_context else forecast.DEFAULT_MONTHS
+
+    # Every argument but the last is a book, see forecast.py
+    with open(args[-1]) as scenario_file:
+        scenarios = json.load(scenario_file)
+    scenarios.setdefault(BASELINE_SCENARIO, {})
+
+    ledger = compactbook.open_ledger(forecast.load_book(args[:-1], compact, jobs), forecast.MONTH_START_DAY)
+    classifier = AccountClassifier(ledger, rules)
+
+    baseline = get_baseline(Membership(ledger), classifier, forecast.report_today(), past, future, models)
+    results = run_scenarios(baseline, scenarios, jobs)
+
+    with open(output, 'wb') as csvfile:
+        writer = csv.DictWriter(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL, fieldnames=FIELDNAMES)
+
+        writer.writeheader()
+        for name in sorted(results):
+            for row in results[name]:
+                row[SCENARIO] = name
+                writer.writerow(row)
+
+            print(name, "projected capital:", results[name][-1][PROJECTED_CAPITAL])
+
+
+def get_baseline(membership, classifier, today, past, future, models):
+    ledger = classifier.ledger
+    history = forecast.get_forecast(ledger, membership, classifier, today, past, 0, log=forecast.quiet,
+                                    models=models, columns=BASELINE_COLUMNS)
+    projections = forecast.get_fitted_projections(classifier, history, models, PROJECTION_NAMES)
+    # The part of the income that dues changes scale, projected like the income
+    dues_income = projection.fit(models['income'], [data_point[DUES] for data_point in history])
+
+    months = []
+    for step, month in enumerate(forecast.report_days(today, today + relativedelta(months=+future)), 1):
+        months.append((month, {
+            'income': forecast.get_projected_income(projections, step),
+            'dues_income': dues_income.forecast(step),
+            'expenses': forecast.get_projected_expenses(projections, step),
+            'rent': forecast.get_rent_expenses_for_month(classifier, month),
+            'dues': projections['dues'].forecast(step),
+            'donations': projections['donations'].forecast(step),
+            'members': projections['members'].forecast(step),
+            'donating_members': projections['donating-members'].forecast(step),
+            'food_income': projections['food-donations'].forecast(step),
+            'food_expenses': projections['food-expenses'].forecast(step),
+        }))
+
+    return {
+        'capital': history[-1][CAPITAL],
+        'months': months,
+    }
+
+
+def run_scenarios(baseline, scenarios, jobs=None):
+    pool = multiprocessing.Pool(jobs, _init_worker, (baseline,))
+    try:
+        results = pool.map(_project_scenario, sorted(scenarios.items()))
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict(results)
+
+
+def _init_worker(baseline):
+    global _baseline
+    _baseline = baseline
+
+
+def _project_scenario(item):
+    name, overrides = item
+    return name, project(_baseline, overrides)
+
+
+def project(baseline, overrides):
+    parameters = dict(DEFAULT_PARAMETERS)
+    for parameter, value in overrides.items():
+        if parameter not in parameters:
+            raise ValueError("Unknown scenario parameter: {}".format(parameter))
+        parameters[parameter] = value
+
+    growth = 1 + _decimal(parameters['member_growth'])
+    dues_ratio = _decimal(parameters['monthly_dues']) / Member.monthy_dues
+    rent_ratio = 1 + _decimal(parameters['rent_increase'])
+    event_spending = _decimal(parameters['event_spending'])
+
+    capital = baseline['capital']
+    members_factor = 1
+    rows = []
+    for month, values in baseline['months']:
+        members_factor *= growth
+        dues_factor = members_factor * dues_ratio
+        rent = values['rent'] * rent_ratio
+        expenses = values['expenses'] - event_spending
+
+        # The income includes donations, only the dues part scales
+        income = values['income'] + values['dues_income'] * (dues_factor - 1)
+        capital = capital + income + expenses + rent
+
+        rows.append({
+            DATE: month,
+            PROJECTED_CAPITAL: capital,
+            PROJECTED_DUES: values['dues'] * dues_factor,
+            PROJECTED_DONATIONS: values['donations'],
+            PROJECTED_MEMBERS: int((values['members'] * members_factor).to_integral_value()),
+            PROJECTED_DONATING_MEMBERS: values['donating_members'],
+            PROJECTED_FOOD_DONATIONS: values['food_income'],
+            PROJECTED_FOOD_EXPENSES: values['food_expenses'],
+            CAPITAL_TARGET: (expenses + rent) * -3,
+            FOOD_PROFIT: values['food_income'] + values['food_expenses'],
+        })
+
+    return rows
+
+
+def _decimal(value):
+    # Scenario files hold JSON floats; go through str so 0.1 stays 0.1
+    return Decimal(str(value))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
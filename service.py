@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import getopt
+import threading
+from datetime import datetime
+from decimal import Decimal
+import compactbook
+import forecast
+import members
+import classify
+from membership import Membership
+from classify import AccountClassifier
+from member import DEFAULT_TIERS, load_members, load_tiers
+
+try:
+    from urllib.parse import urlparse, parse_qs
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from urlparse import urlparse, parse_qs
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+# Forecast, member and aging reports over local HTTP/JSON, from books that
+# stay loaded between requests.
+#
+#     GET /forecast?past=6&future=6&paths=1000
+#     GET /members
+#     GET /aging?months=12
+#     GET /status
+#
+# The books are polled for changes and reloaded in the background; requests
+# keep being answered from the previous book until the new one is ready.
+# Books are loaded like forecast.py loads them (several books are
+# consolidated, -k keeps them compact, SQLite books are queried in place) and
+# the per-period forecast results are kept across reloads, so a reload only
+# recomputes the periods with new or edited transactions. With -i they are
+# also saved to a state file, see incremental.py. Responses are kept until
+# the book changes or the reporting month rolls over.
+#
+# Dates are sent as ISO strings and amounts as decimal strings, so nothing
+# is lost to floating point.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_POLL = 2.0
+
+
+class ForecastService(object):
+    def __init__(self, filenames, rules=forecast.DEFAULT_ACCOUNT_RULES, tiers=DEFAULT_TIERS, state_filename=None,
+                 compact=False, jobs=None):
+        self.filenames = filenames
+        self.rules = rules
+        self.tiers = tiers
+        self.compact = compact
+        self.jobs = jobs
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._signature = None
+        # Shared by every loaded book; forecasts that use it run one at a time
+        self._state = forecast.open_state(state_filename, compact, rules)
+        self._state_lock = threading.Lock()
+        self.reload()
+
+    def _book_signature(self):
+        signature = []
+        for filename in self.filenames:
+            stat = os.stat(filename)
+            signature.append((stat.st_size, stat.st_mtime))
+        return signature
+
+    def reload(self):
+        signature = self._book_signature()
+        started = time.time()
+
+        book = forecast.load_book(self.filenames, self.compact, self.jobs)
+        ledger = compactbook.open_ledger(book, forecast.MONTH_START_DAY)
+        loaded = {
+            'book': book,
+            'ledger': ledger,
+            'membership': Membership(ledger),
+            'classifier': AccountClassifier(ledger, self.rules),
+            'members': None,
+            'responses': {},
+            'lock': threading.Lock(),
+            'loaded': datetime.now(),
+        }
+
+        # Have the default reports ready before the new book answers requests
+        self.forecast(forecast.DEFAULT_MONTHS, forecast.DEFAULT_MONTHS, loaded=loaded)
+        self.members(loaded)
+        loaded['load_seconds'] = time.time() - started
+
+        with self._lock:
+            self._loaded = loaded
+            self._signature = signature
+            self.reloads += 1
+
+    def reload_if_changed(self):
+        try:
+            changed = self._book_signature() != self._signature
+        except OSError:
+            # The book is being replaced; try again on the next poll
+            return False
+        if changed:
+            self.reload()
+        return changed
+
+    def watch(self, interval):
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self.reload_if_changed():
+                        print("Reloaded", ", ".join(self.filenames))
+                except Exception as error:
+                    print("ERROR: could not reload", ", ".join(self.filenames), ":", error)
+
+        thread = threading.Thread(target=poll)
+        thread.daemon = True
+        thread.start()
+
+    def _response(self, key, compute, loaded=None):
+        if loaded is None:
+            with self._lock:
+                loaded = self._loaded
+
+        # Cached responses are specific to the reporting month
+        key = (forecast.report_today(),) + key
+        with loaded['lock']:
+            if key not in loaded['responses']:
+                loaded['responses'][key] = compute(loaded)
+            return loaded['responses'][key]
+
+    def _members(self, loaded):
+        # Made on first use, under the loaded book's lock
+        if loaded['members'] is None:
+            loaded['members'] = load_members(loaded['book'], self.tiers)
+        return loaded['members']
+
+    def forecast(self, past, future, simulated_paths=None, loaded=None):
+        def compute(loaded):
+            with self._state_lock:
+                history = forecast.get_forecast(loaded['ledger'], loaded['membership'], loaded['classifier'],
+                                                forecast.report_today(), past, future, self._state, simulated_paths,
+                                                log=forecast.quiet)
+            return {'fieldnames': forecast.get_fieldnames(simulated_paths), 'rows': history}
+
+        return self._response(('forecast', past, future, simulated_paths), compute, loaded)
+
+    def members(self, loaded=None):
+        def compute(loaded):
+            return {'rows': [members.get_member_row(member) for member in self._members(loaded)]}
+
+        return self._response(('members',), compute, loaded)
+
+    def aging(self, months_back):
+        def compute(loaded):
+            fieldnames, rows = members.get_aging_report(loaded['ledger'], self._members(loaded), months_back)
+            return {'fieldnames': fieldnames, 'rows': rows}
+
+        return self._response(('aging', months_back), compute)
+
+    def status(self):
+        with self._lock:
+            loaded = self._loaded
+        return {
+            'books': self.filenames,
+            'loaded': loaded['loaded'],
+            'load_seconds': loaded['load_seconds'],
+            'reloads': self.reloads,
+        }
+
+
+class ForecastServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, ForecastRequestHandler)
+        self.service = service
+
+
+class ForecastRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = dict((name, values[-1]) for name, values in parse_qs(url.query).items())
+        service = self.server.service
+
+        try:
+            if url.path == '/forecast':
+                paths = query.get('paths')
+                result = service.forecast(_months(query, 'past'), _months(query, 'future'),
+                                          int(paths) if paths else None)
+            elif url.path == '/members':
+                result = service.members()
+            elif url.path == '/aging':
+                result = service.aging(_months(query, 'months'))
+            elif url.path == '/status':
+                result = service.status()
+            else:
+                self._send(404, {'error': 'Unknown report: {}'.format(url.path)})
+                return
+        except ValueError as error:
+            self._send(400, {'error': str(error)})
+            return
+        except Exception as error:
+            print("ERROR: could not answer", self.path, ":", error)
+            self._send(500, {'error': str(error)})
+            return
+
+        self._send(200, result)
+
+    def _send(self, status, result):
+        body = json.dumps(result, default=_json_value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _months(query, name):
+    months = int(query.get(name, forecast.DEFAULT_MONTHS))
+    if months < 1:
+        raise ValueError("{} must be at least one month".format(name))
+    return months
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError("Cannot send {!r} as JSON".format(value))
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h:i:j:kp:r:t:w:")
+    except getopt.GetoptError:
+        print("argument error")
+        sys.exit(2)
+
+    host = DEFAULT_HOST
+    port = DEFAULT_PORT
+    poll = DEFAULT_POLL
+    rules = forecast.DEFAULT_ACCOUNT_RULES
+    tiers = DEFAULT_TIERS
+    state_filename = None
+    jobs = None
+    compact = False
+
+    for opt, arg in opts:
+        if opt == '-h':
+            host = arg
+        elif opt == '-i':
+            state_filename = arg
+        elif opt == '-j':
+            jobs = int(arg)
+        elif opt == '-k':
+            compact = True
+        elif opt == '-p':
+            port = int(arg)
+        elif opt == '-r':
+            rules = classify.load_rules(arg)
+        elif opt == '-t':
+            tiers = load_tiers(arg)
+        elif opt == '-w':
+            poll = float(arg)
+
+    # Several books are consolidated, see forecast.py
+    service = ForecastService(args, rules, tiers, state_filename, compact, jobs)
+    service.watch(poll)
+
+    server = ForecastServer((host, port), service)
+    print("Serving", ", ".join(args), "on", "http://{}:{}/".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import sys
+import gzip
+import uuid
+import random
+import getopt
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from xml.sax.saxutils import escape
+
+
+# Writes a synthetic GnuCash XML book with the account tree forecast.py,
+# members.py and emails.py expect, for benchmarking. Every month has a dues
+# transaction for the paying members, their payments, regular donations,
+# rent, landlord and event activity, and a configurable number of
+# expense/food transactions. The book ends in the current month.
+
+DEFAULT_MEMBERS = 60
+DEFAULT_YEARS = 3
+DEFAULT_TRANSACTIONS = 20
+
+NAMESPACES = ' '.join('xmlns:{0}="http://www.gnucash.org/XML/{0}"'.format(namespace) for namespace in
+                      ['gnc', 'act', 'book', 'cd', 'cmdty', 'slot', 'split', 'trn', 'ts'])
+
+ACCOUNTS = [
+    ("Assets", "Root Account", "ASSET"),
+    ("Current Assets", "Assets", "ASSET"),
+    ("Checking", "Current Assets", "BANK"),
+    ("Petty Cash", "Current Assets", "CASH"),
+    ("Prepaid Rent", "Current Assets", "ASSET"),
+    ("Liabilities", "Root Account", "LIABILITY"),
+    ("Active Members", "Liabilities", "LIABILITY"),
+    ("Full Members", "Active Members", "LIABILITY"),
+    ("Student Members", "Active Members", "LIABILITY"),
+    ("Former Members", "Liabilities", "LIABILITY"),
+    ("Landlord", "Liabilities", "LIABILITY"),
+    ("Unknown", "Liabilities", "LIABILITY"),
+    ("Income", "Root Account", "INCOME"),
+    ("Member Dues", "Income", "INCOME"),
+    ("Regular donations", "Income", "INCOME"),
+    ("Food and Drink Donations", "Income", "INCOME"),
+    ("Anti-social 10-04", "Income", "INCOME"),
+    ("Expenses", "Root Account", "EXPENSE"),
+    ("Rent", "Expenses", "EXPENSE"),
+    ("Utilities", "Expenses", "EXPENSE"),
+    ("Internet", "Expenses", "EXPENSE"),
+    ("Supplies", "Expenses", "EXPENSE"),
+    ("Groceries", "Expenses", "EXPENSE"),
+    ("Hacker Jeopardy Ron's Revenge", "Expenses", "EXPENSE"),
+]
+
+SPENDING_ACCOUNTS = ["Utilities", "Internet", "Supplies", "Hacker Jeopardy Ron's Revenge"]
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "m:s:t:y:")
+    except getopt.GetoptError:
+        print("argument error")
+        sys.exit(2)
+
+    members = DEFAULT_MEMBERS
+    years = DEFAULT_YEARS
+    transactions = DEFAULT_TRANSACTIONS
+    seed = None
+
+    for opt, arg in opts:
+        if opt == '-m':
+            members = int(arg)
+        elif opt == '-s':
+            seed = int(arg)
+        elif opt == '-t':
+            transactions = int(arg)
+        elif opt == '-y':
+            years = int(arg)
+
+    write_book(args[0], members, years, transactions, seed)
+
+
+def write_book(filename, members=DEFAULT_MEMBERS, years=DEFAULT_YEARS, transactions=DEFAULT_TRANSACTIONS, seed=None):
+    generator = random.Random(seed)
+    guids = {}
+
+    def guid():
+        return uuid.UUID(int=generator.getrandbits(128)).hex
+
+    book_file = gzip.open(filename, 'wb')
+
+    def write(text):
+        book_file.write(text.encode('utf-8'))
+
+    def account(name, parent, actype, description=None):
+        guids[name] = guid()
+        write('<gnc:account version="2.0.0">\n<act:name>{}</act:name>\n<act:id type="guid">{}</act:id>\n'
+              '<act:type>{}</act:type>\n'.format(escape(name), guids[name], actype))
+        if parent is not None:
+            write('<act:commodity>\n<cmdty:space>ISO4217</cmdty:space>\n<cmdty:id>CAD</cmdty:id>\n</act:commodity>\n'
+                  '<act:commodity-scu>100</act:commodity-scu>\n')
+            if description:
+                write('<act:description>{}</act:description>\n'.format(escape(description)))
+            write('<act:parent type="guid">{}</act:parent>\n'.format(guids[parent]))
+        write('</gnc:account>\n')
+
+    def transaction(date, description, splits):
+        date = date.strftime('%Y-%m-%d %H:%M:%S') + ' -0600'
+        write('<gnc:transaction version="2.0.0">\n<trn:id type="guid">{}</trn:id>\n'
+              '<trn:currency>\n<cmdty:space>ISO4217</cmdty:space>\n<cmdty:id>CAD</cmdty:id>\n</trn:currency>\n'
+              '<trn:date-posted>\n<ts:date>{}</ts:date>\n</trn:date-posted>\n'
+              '<trn:date-entered>\n<ts:date>{}</ts:date>\n</trn:date-entered>\n'
+              '<trn:description>{}</trn:description>\n<trn:splits>\n'.format(guid(), date, date, description))
+        for name, cents in splits:
+            write('<trn:split>\n<split:id type="guid">{}</split:id>\n<split:reconciled-state>n</split:reconciled-state>\n'
+                  '<split:value>{}/100</split:value>\n<split:quantity>{}/100</split:quantity>\n'
+                  '<split:account type="guid">{}</split:account>\n</trn:split>\n'.format(guid(), cents, cents,
+                                                                                          guids[name]))
+        write('</trn:splits>\n</gnc:transaction>\n')
+
+    write('<?xml version="1.0" encoding="utf-8" ?>\n<gnc-v2 {}>\n'.format(NAMESPACES))
+    write('<gnc:count-data cd:type="book">1</gnc:count-data>\n<gnc:book version="2.0.0">\n'
+          '<book:id type="guid">{}</book:id>\n'.format(guid()))
+    write('<gnc:commodity version="2.0.0">\n<cmdty:space>ISO4217</cmdty:space>\n<cmdty:id>CAD</cmdty:id>\n'
+          '</gnc:commodity>\n')
+
+    account("Root Account", None, "ROOT")
+    for name, parent, actype in ACCOUNTS:
+        account(name, parent, actype)
+
+    roster = []
+    for number in range(members):
+        name = "Member {:04d}".format(number)
+        if number % 5 == 0:
+            tier, dues = "Student Members", 20
+        else:
+            tier, dues = "Full Members", 40
+        # Every so often a member has no email address on record
+        description = "member{}@example.com".format(number) if number % 13 else "no email"
+        account(name, tier, "LIABILITY", description)
+        roster.append((name, dues))
+
+    today = datetime.now()
+    month = datetime(today.year, today.month, 1) - relativedelta(years=+years)
+    while month <= today:
+        paying = [member for member in roster if generator.random() < 0.85]
+        if paying:
+            transaction(month, "Dues", [("Member Dues", -100 * sum(dues for name, dues in paying))] +
+                        [(name, 100 * dues) for name, dues in paying])
+
+        for name, dues in paying:
+            paid = month + relativedelta(days=generator.randint(0, 27))
+            transaction(paid, "Payment", [("Checking", 100 * dues), (name, -100 * dues)])
+
+        donors = paying[:generator.randint(1, 5)]
+        if donors:
+            transaction(month + relativedelta(days=3), "Donations",
+                        [("Regular donations", -1000 * len(donors))] + [(name, 1000) for name, dues in donors])
+
+        transaction(month + relativedelta(days=5), "Rent", [("Rent", 150000), ("Checking", -150000)])
+        transaction(month + relativedelta(days=9), "Landlord", [("Landlord", -1000), ("Checking", 1000)])
+        transaction(month + relativedelta(days=6), "Event", [("Checking", 5000), ("Anti-social 10-04", -5000)])
+
+        for number in range(transactions):
+            posted = month + relativedelta(days=generator.randint(0, 27), hours=generator.choice([0, 10, 23]))
+            if number % 2:
+                cents = generator.randint(500, 9000)
+                transaction(posted, "Food", [("Checking", cents), ("Food and Drink Donations", -cents)])
+            else:
+                cents = generator.randint(1000, 20000)
+                spent_on = generator.choice(SPENDING_ACCOUNTS + ["Groceries"])
+                transaction(posted, "Spending", [(spent_on, cents), ("Checking", -cents)])
+
+        month += relativedelta(months=+1)
+
+    write('</gnc:book>\n</gnc-v2>\n')
+    book_file.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
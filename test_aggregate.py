@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import unittest
+from datetime import datetime
+from decimal import Decimal
+import aggregate
+import compactbook
+import flatbook
+from ledger import Ledger
+
+
+MONTH_START_DAY = 6
+
+
+def make_book(transactions):
+    # transactions: (date, [(account name, value)]), accounts all under the root
+    root = flatbook.Account(guid='root', name='Root Account', actype='ROOT')
+    accounts = {}
+    book_transactions = []
+    for number, (date, splits) in enumerate(transactions):
+        transaction = flatbook.Transaction(guid='{:032x}'.format(number + 1), date=date, description='')
+        for name, value in splits:
+            if name not in accounts:
+                accounts[name] = flatbook.Account(guid='{:032x}'.format(len(accounts) + 1000), name=name,
+                                                  actype='INCOME', parent=root)
+                root.children.append(accounts[name])
+            split = flatbook.Split(value=Decimal(value), account=accounts[name], transaction=transaction)
+            transaction.splits.append(split)
+            accounts[name].splits.append(split)
+        book_transactions.append(transaction)
+    return flatbook.Book(root, book_transactions)
+
+
+def ledgers(book):
+    return [Ledger(book, MONTH_START_DAY),
+            compactbook.open_ledger(compactbook.CompactBook(flatbook.flatten(book)), MONTH_START_DAY)]
+
+
+class AggregateTest(unittest.TestCase):
+    def columns(self, ledger):
+        return [('dues', aggregate.SUM, [ledger.account('Dues')], -1),
+                ('payers', aggregate.COUNT, [ledger.account('Dues')], 1)]
+
+    def test_sub_cent_splits_are_added_as_decimals(self):
+        # 12345/1000, as gnucashxml parses a value that isn't in hundredths
+        book = make_book([
+            (datetime(2020, 1, 10), [('Dues', '-50.00'), ('Alice', '50.00')]),
+            (datetime(2020, 1, 20), [('Dues', '-12.345'), ('Bob', '12.345')]),
+            (datetime(2020, 2, 10), [('Dues', '-50.00'), ('Alice', '50.00')]),
+        ])
+        months = [datetime(2020, 2, 6), datetime(2020, 3, 6)]
+
+        for ledger in ledgers(book):
+            rows = aggregate.aggregate(ledger, months, self.columns(ledger))
+
+            self.assertEqual(str(rows[0]['dues']), '62.345')
+            self.assertEqual(str(rows[1]['dues']), '50.00')
+            self.assertEqual([row['payers'] for row in rows], [2, 1])
+            self.assertEqual(str(ledger.total(ledger.account('Dues'), months[0])), '-62.345')
+
+    def test_empty_period_is_a_plain_zero(self):
+        book = make_book([(datetime(2020, 1, 10), [('Dues', '-50.00'), ('Alice', '50.00')])])
+        months = [datetime(2020, 2, 6), datetime(2020, 3, 6)]
+
+        for ledger in ledgers(book):
+            rows = aggregate.aggregate(ledger, months, self.columns(ledger))
+
+            self.assertEqual(str(rows[0]['dues']), '50.00')
+            self.assertEqual(str(rows[1]['dues']), '0')
+            self.assertEqual(rows[1]['payers'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
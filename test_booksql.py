@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+import booksql
+from membership import Membership
+
+
+# A small GnuCash SQLite book, read five hours west of UTC. Reporting periods
+# close at local midnight on the 6th, which is 05:00 UTC as GnuCash stores it.
+
+MONTH_START_DAY = 6
+
+ACCOUNTS = [
+    ('root', 'Root Account', 'ROOT', None),
+    ('assets', 'Current Assets', 'ASSET', 'root'),
+    ('bank', 'Bank', 'BANK', 'assets'),
+    ('income', 'Income', 'INCOME', 'root'),
+    ('dues', 'Member Dues', 'INCOME', 'income'),
+    ('members', 'Active Members', 'ASSET', 'root'),
+    ('alice', 'Alice', 'ASSET', 'members'),
+    ('bob', 'Bob', 'ASSET', 'members'),
+]
+
+# (guid, post date in UTC, [(account, value_num, value_denom)])
+TRANSACTIONS = [
+    ('t1', '2020-01-20 15:00:00', [('dues', -5000, 100), ('alice', 5000, 100)]),
+    # 22:00 on Feb 5th local time, the last evening of the period closing Feb 6th
+    ('t2', '2020-02-06 03:00:00', [('dues', -5050, 100), ('bob', 5050, 100)]),
+    # 01:00 on Feb 6th local time, already in the period closing Mar 6th
+    ('t3', '2020-02-06 06:00:00', [('dues', -5000, 100), ('alice', 5000, 100)]),
+    ('t4', '2020-02-10 15:00:00', [('bank', 10050, 100), ('alice', -5000, 100), ('bob', -5050, 100)]),
+]
+
+
+def write_book(filename):
+    connection = sqlite3.connect(filename)
+    connection.executescript('''
+        CREATE TABLE books (guid TEXT PRIMARY KEY, root_account_guid TEXT, root_template_guid TEXT);
+        CREATE TABLE accounts (guid TEXT PRIMARY KEY, name TEXT, account_type TEXT, parent_guid TEXT,
+                               description TEXT);
+        CREATE TABLE transactions (guid TEXT PRIMARY KEY, post_date TEXT, description TEXT);
+        CREATE INDEX tx_post_date_index ON transactions (post_date);
+        CREATE TABLE splits (guid TEXT PRIMARY KEY, tx_guid TEXT, account_guid TEXT, value_num INTEGER,
+                             value_denom INTEGER);
+        CREATE INDEX splits_tx_guid_index ON splits (tx_guid);
+        CREATE INDEX splits_account_guid_index ON splits (account_guid);''')
+    connection.execute("INSERT INTO books VALUES ('book', 'root', 'template')")
+    for guid, name, actype, parent in ACCOUNTS:
+        connection.execute('INSERT INTO accounts VALUES (?, ?, ?, ?, ?)', (guid, name, actype, parent, ''))
+    for guid, post_date, splits in TRANSACTIONS:
+        connection.execute('INSERT INTO transactions VALUES (?, ?, ?)', (guid, post_date, 'Dues'))
+        for number, (account, value_num, value_denom) in enumerate(splits):
+            connection.execute('INSERT INTO splits VALUES (?, ?, ?, ?, ?)',
+                               ('{}-{}'.format(guid, number), guid, account, value_num, value_denom))
+    connection.commit()
+    connection.close()
+
+
+@unittest.skipUnless(hasattr(time, 'tzset'), "needs time.tzset")
+class SqlBookTest(unittest.TestCase):
+    def setUp(self):
+        self.tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'EST5'
+        time.tzset()
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.filename = os.path.join(directory, 'book.gnucash')
+        write_book(self.filename)
+
+        self.book = booksql.from_filename(self.filename)
+        self.ledger = booksql.SqlLedger(self.book, MONTH_START_DAY)
+
+    def tearDown(self):
+        if self.tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+
+    def test_post_dates_are_local(self):
+        dates = dict((transaction.guid, transaction.date) for transaction in self.book.transactions)
+
+        self.assertEqual(dates['t2'], datetime(2020, 2, 5, 22, 0))
+        self.assertEqual(dates['t3'], datetime(2020, 2, 6, 1, 0))
+        self.assertEqual(self.book.latest_transaction(), (datetime(2020, 2, 10, 10, 0), 't4'))
+
+    def test_period_boundary(self):
+        dues = self.ledger.account("Member Dues")
+        february = datetime(2020, 2, 6)
+        march = datetime(2020, 3, 6)
+
+        self.assertEqual(self.ledger.total(dues, february), Decimal('-100.5'))
+        self.assertEqual(str(self.ledger.total(dues, march)), '-50')
+        self.assertEqual([split.transaction.guid for split in self.ledger.splits(dues, february)], ['t1', 't2'])
+        self.assertEqual(self.ledger.balance(dues, february), Decimal('-100.5'))
+        self.assertEqual(self.ledger.balance(dues, datetime(2020, 2, 5, 23)), Decimal('-100.5'))
+        self.assertEqual(self.ledger.balance(dues, datetime(2020, 2, 6, 1)), Decimal('-150.5'))
+
+        membership = Membership(self.ledger)
+        self.assertEqual(membership.members(february), set(['Alice', 'Bob']))
+        self.assertEqual(membership.members(march), set(['Alice']))
+
+    def test_aggregate(self):
+        periods = [(datetime(2020, 1, 6), datetime(2020, 2, 6)), (datetime(2020, 2, 6), datetime(2020, 3, 6))]
+
+        cents, counts, exponents = self.book.aggregate(periods, [['dues'], ['bank']])
+
+        self.assertEqual(cents, [[-10050, -5000], [0, 10050]])
+        self.assertEqual(counts, [[2, 1], [0, 2]])
+        self.assertEqual(exponents, [[-1, 0], [None, -1]])
+
+    def test_sub_cent_splits_are_added_as_decimals(self):
+        connection = sqlite3.connect(self.filename)
+        connection.execute("INSERT INTO transactions VALUES ('t5', '2020-02-20 15:00:00', 'Dues')")
+        connection.executemany('INSERT INTO splits VALUES (?, ?, ?, ?, ?)', [
+            ('t5-0', 't5', 'dues', -12345, 1000), ('t5-1', 't5', 'bob', 12345, 1000)])
+        connection.commit()
+        connection.close()
+        book = booksql.from_filename(self.filename)
+        ledger = booksql.SqlLedger(book, MONTH_START_DAY)
+        march = datetime(2020, 3, 6)
+
+        cents, counts, exponents = book.aggregate([(datetime(2020, 2, 6), march)], [['dues']])
+
+        self.assertEqual(cents, [[Decimal('-6234.500')]])
+        self.assertEqual(exponents, [[-3]])
+        self.assertEqual(str(ledger.total(ledger.account("Member Dues"), march)), '-62.345')
+        self.assertEqual(str(ledger.balance(ledger.account("Member Dues"), march)), '-162.845')
+
+    def test_balance_before_first_split(self):
+        self.assertEqual(self.ledger.balance(self.ledger.account("Bank"), datetime(2020, 2, 6)), 0)
+        self.assertEqual(self.ledger.balance(self.ledger.account("Current Assets"), datetime(2020, 3, 6)),
+                         Decimal('100.5'))
+
+
+if __name__ == '__main__':
+    unittest.main()
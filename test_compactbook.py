@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+from dateutil.relativedelta import relativedelta
+import bookcache
+import compactbook
+import flatbook
+import forecast
+import synthbook
+from classify import AccountClassifier
+from ledger import Ledger
+
+
+class CompactLedgerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'synthetic.gnucash')
+        synthbook.write_book(filename, members=20, years=2, transactions=10, seed=1)
+        self.book = bookcache.load(filename, use_cache=False)
+
+        today = forecast.report_today()
+        self.months = list(forecast.report_days(today - relativedelta(years=+2, months=+1), today))
+
+    def ledgers(self):
+        return (Ledger(self.book, forecast.MONTH_START_DAY),
+                compactbook.open_ledger(compactbook.CompactBook(flatbook.flatten(self.book)),
+                                        forecast.MONTH_START_DAY))
+
+    def test_aggregates_match_the_plain_ledger(self):
+        ledger, compact = self.ledgers()
+
+        expected = forecast.get_monthly_aggregates(AccountClassifier(ledger, forecast.DEFAULT_ACCOUNT_RULES),
+                                                   self.months)
+        actual = forecast.get_monthly_aggregates(AccountClassifier(compact, forecast.DEFAULT_ACCOUNT_RULES),
+                                                 self.months)
+
+        self.assertEqual([sorted((name, str(value)) for name, value in totals.items()) for totals in actual],
+                         [sorted((name, str(value)) for name, value in totals.items()) for totals in expected])
+        self.assertTrue(any(totals[forecast.DUES] for totals in expected))
+
+    def test_balances_match_the_plain_ledger(self):
+        ledger, compact = self.ledgers()
+
+        for account, children, splits in self.book.walk():
+            for month in self.months:
+                for subtree in (True, False):
+                    self.assertEqual(str(compact.balance(compact.account(account.name), month, subtree)),
+                                     str(ledger.balance(ledger.account(account.name), month, subtree)),
+                                     (account.name, month, subtree))
+
+
+if __name__ == '__main__':
+    unittest.main()
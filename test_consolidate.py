@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import unittest
+from datetime import datetime
+from decimal import Decimal
+import consolidate
+import flatbook
+
+
+# Fiscal year books as separate files would hold them: the same account tree
+# under different GUIDs, each year opening with the balances the year before
+# closed with.
+
+TREE = [
+    ('Assets', 'ASSET', None),
+    ('Bank', 'BANK', 'Assets'),
+    ('Income', 'INCOME', None),
+    ('Member Dues', 'INCOME', 'Income'),
+    ('Equity', 'EQUITY', None),
+    ('Opening Balances', 'EQUITY', 'Equity'),
+]
+
+DUES_2019 = ('dues-2019', datetime(2019, 6, 10), [('Member Dues', '-50.00'), ('Bank', '50.00')])
+OPENING_2020 = ('opening-2020', datetime(2020, 1, 1), [('Opening Balances', '-50.00'), ('Bank', '50.00')])
+DUES_2020 = ('dues-2020', datetime(2020, 6, 10), [('Member Dues', '-40.00'), ('Bank', '40.00')])
+OPENING_2021 = ('opening-2021', datetime(2021, 1, 1), [('Opening Balances', '-90.00'), ('Bank', '90.00')])
+DUES_2021 = ('dues-2021', datetime(2021, 6, 10), [('Member Dues', '-30.00'), ('Bank', '30.00')])
+
+
+def make_book(name, transactions, descriptions=None):
+    # transactions: (guid, date, [(account name, value)])
+    descriptions = descriptions or {}
+    root = flatbook.Account(guid=name + '-root', name='Root Account', actype='ROOT')
+    accounts = {}
+    for account_name, actype, parent in TREE:
+        parent = accounts[parent] if parent else root
+        accounts[account_name] = flatbook.Account(guid='{}-{}'.format(name, account_name), name=account_name,
+                                                  actype=actype, description=descriptions.get(account_name),
+                                                  parent=parent)
+        parent.children.append(accounts[account_name])
+
+    book_transactions = []
+    for guid, date, splits in transactions:
+        transaction = flatbook.Transaction(guid=guid, date=date, description='')
+        for account_name, value in splits:
+            split = flatbook.Split(value=Decimal(value), account=accounts[account_name], transaction=transaction)
+            transaction.splits.append(split)
+            accounts[account_name].splits.append(split)
+        book_transactions.append(transaction)
+    return flatbook.Book(root, book_transactions)
+
+
+def balance(book, name):
+    return sum(split.value for split in book.find_account(name).splits)
+
+
+class MergeTest(unittest.TestCase):
+    def test_books_are_merged_in_date_order(self):
+        merged = consolidate.merge([make_book('2021', [OPENING_2021, DUES_2021]),
+                                    make_book('2019', [DUES_2019]),
+                                    make_book('2020', [OPENING_2020, DUES_2020])])
+
+        self.assertEqual([transaction.guid for transaction in merged.transactions],
+                         ['dues-2019', 'dues-2020', 'dues-2021'])
+        self.assertEqual([account.name for account, children, splits in merged.walk()],
+                         ['Root Account'] + [name for name, actype, parent in TREE if parent is None]
+                         + [name for name, actype, parent in TREE if parent is not None])
+        self.assertEqual(balance(merged, 'Bank'), Decimal('120.00'))
+        self.assertEqual(balance(merged, 'Member Dues'), Decimal('-120.00'))
+        self.assertEqual(balance(merged, 'Opening Balances'), 0)
+
+    def test_opening_balances_of_the_earliest_book_are_kept(self):
+        merged = consolidate.merge([make_book('2020', [OPENING_2020, DUES_2020]),
+                                    make_book('2021', [OPENING_2021, DUES_2021])])
+
+        self.assertEqual([transaction.guid for transaction in merged.transactions],
+                         ['opening-2020', 'dues-2020', 'dues-2021'])
+        self.assertEqual(balance(merged, 'Bank'), Decimal('120.00'))
+
+    def test_transactions_in_several_books_are_kept_once(self):
+        # The 2020 book was started from a copy of the 2019 one
+        merged = consolidate.merge([make_book('2019', [DUES_2019]),
+                                    make_book('2020', [DUES_2019, OPENING_2020, DUES_2020])])
+
+        self.assertEqual([transaction.guid for transaction in merged.transactions], ['dues-2019', 'dues-2020'])
+        self.assertEqual(balance(merged, 'Member Dues'), Decimal('-90.00'))
+
+    def test_duplicate_books(self):
+        merged = consolidate.merge([make_book('copy', [DUES_2019, DUES_2020]),
+                                    make_book('original', [DUES_2019, DUES_2020])])
+
+        self.assertEqual([transaction.guid for transaction in merged.transactions], ['dues-2019', 'dues-2020'])
+        self.assertEqual(balance(merged, 'Bank'), Decimal('90.00'))
+        self.assertEqual(len(merged.find_account('Bank').splits), 2)
+
+    def test_later_books_update_account_descriptions(self):
+        merged = consolidate.merge([make_book('2020', [DUES_2020], {'Bank': 'new@example.com'}),
+                                    make_book('2019', [DUES_2019], {'Bank': 'old@example.com'})])
+
+        self.assertEqual(merged.find_account('Bank').description, 'new@example.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
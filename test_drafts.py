@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import email.message
+import drafts
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+# A stand-in IMAP server on localhost that knows just enough of the protocol
+# for DraftSender: LOGIN, SELECT, APPEND and LOGOUT. It counts logins, keeps
+# the appended messages, and can drop the connection instead of answering
+# chosen APPENDs to make the sender reconnect.
+
+class FakeImapServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, drop_appends=()):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), FakeImapHandler)
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.appends = 0
+        self.drop_appends = set(drop_appends)
+        self.messages = []
+
+    def url(self):
+        return 'imap://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class FakeImapHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        self.wfile.write(b'* OK [CAPABILITY IMAP4rev1] Fake IMAP ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, command = line.split(b' ', 2)[:2]
+            command = command.strip().upper()
+
+            if command == b'CAPABILITY':
+                self.wfile.write(b'* CAPABILITY IMAP4rev1\r\n' + tag + b' OK CAPABILITY completed\r\n')
+            elif command == b'LOGIN':
+                with server.lock:
+                    server.logins += 1
+                self.wfile.write(tag + b' OK LOGIN completed\r\n')
+            elif command == b'SELECT':
+                self.wfile.write(b'* 0 EXISTS\r\n' + tag + b' OK [READ-WRITE] SELECT completed\r\n')
+            elif command == b'APPEND':
+                size = int(line[line.rindex(b'{') + 1:line.rindex(b'}')])
+                self.wfile.write(b'+ Ready\r\n')
+                message = self.rfile.read(size)
+                self.rfile.readline()
+                with server.lock:
+                    server.appends += 1
+                    drop = server.appends in server.drop_appends
+                    if not drop:
+                        server.messages.append(message)
+                if drop:
+                    return
+                self.wfile.write(tag + b' OK APPEND completed\r\n')
+            elif command == b'LOGOUT':
+                self.wfile.write(b'* BYE\r\n' + tag + b' OK LOGOUT completed\r\n')
+                return
+            else:
+                self.wfile.write(tag + b' BAD unknown command\r\n')
+
+
+def make_messages(count):
+    messages = []
+    for number in range(count):
+        message = email.message.Message()
+        message['Subject'] = 'Reminder {}'.format(number)
+        message.set_payload('Dues reminder {}'.format(number))
+        messages.append(message)
+    return messages
+
+
+def unused_port():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+
+class ImapTestCase(unittest.TestCase):
+    def start_server(self, drop_appends=()):
+        server = FakeImapServer(drop_appends)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def sender(self, url, workers=4, attempts=None):
+        connect = drafts.connector(url, 'user', 'secret', 'Drafts')
+        if attempts is not None:
+            def counted():
+                attempts.append(1)
+                return connect()
+            return drafts.DraftSender(counted, 'Drafts', workers, retries=3, backoff=0.01)
+        return drafts.DraftSender(connect, 'Drafts', workers, retries=3, backoff=0.01)
+
+
+class DraftSenderTest(ImapTestCase):
+    def test_sessions_are_pooled(self):
+        server = self.start_server()
+
+        stats = self.sender(server.url()).send(make_messages(25))
+
+        self.assertEqual(stats.sent(), 25)
+        self.assertEqual(stats.failures, [])
+        self.assertEqual(len(server.messages), 25)
+        self.assertTrue(1 <= server.logins <= 4)
+
+    def test_dropped_connection_is_retried_on_a_new_session(self):
+        server = self.start_server(drop_appends=[3, 7])
+
+        stats = self.sender(server.url(), workers=2).send(make_messages(10))
+
+        self.assertEqual(stats.sent(), 10)
+        self.assertEqual(stats.failures, [])
+        subjects = sorted(re.search(b'Subject: (.*?)\r?\n', message).group(1) for message in server.messages)
+        self.assertEqual(subjects, sorted('Reminder {}'.format(number).encode('ascii') for number in range(10)))
+        self.assertTrue(server.logins >= 3)
+
+    def test_unreachable_server_fails_the_run_once(self):
+        attempts = []
+
+        stats = self.sender('imap://127.0.0.1:{}'.format(unused_port()), workers=2,
+                            attempts=attempts).send(make_messages(30))
+
+        self.assertEqual(stats.sent(), 0)
+        self.assertEqual(len(stats.failures), 30)
+        # Each worker retries its first message, then the rest fail without connecting
+        self.assertTrue(len(attempts) <= 2 * 4)
+
+
+class OutboxTest(ImapTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_mbox_is_replaced(self):
+        path = os.path.join(self.directory, 'outbox.mbox')
+
+        drafts.write_outbox(path, make_messages(3))
+        drafts.write_outbox(path, make_messages(2))
+
+        self.assertEqual([message['Subject'] for message in drafts.read_outbox(path)],
+                         ['Reminder 0', 'Reminder 1'])
+        self.assertEqual(os.listdir(self.directory), ['outbox.mbox'])
+
+    def test_full_maildir_is_refused(self):
+        path = os.path.join(self.directory, 'outbox') + '/'
+
+        drafts.write_outbox(path, make_messages(3))
+
+        self.assertRaises(ValueError, drafts.write_outbox, path, make_messages(2))
+        self.assertEqual(len(list(drafts.read_outbox(path))), 3)
+
+    def test_mbox_keeps_its_mode(self):
+        path = os.path.join(self.directory, 'outbox.mbox')
+        drafts.write_outbox(path, make_messages(1))
+        os.chmod(path, 0o640)
+
+        drafts.write_outbox(path, make_messages(2))
+
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+    def test_uploaded_messages_leave_the_outbox(self):
+        server = self.start_server(drop_appends=[2])
+        for path in [os.path.join(self.directory, 'outbox') + '/', os.path.join(self.directory, 'outbox.mbox')]:
+            drafts.write_outbox(path, make_messages(3))
+
+            stats = drafts.send_outbox(self.sender(server.url(), workers=2), path)
+
+            self.assertEqual(stats.sent(), 3)
+            self.assertEqual(list(drafts.read_outbox(path)), [])
+            drafts.write_outbox(path, make_messages(2))
+            self.assertEqual(len(list(drafts.read_outbox(path))), 2)
+
+    def test_failed_messages_stay_in_the_outbox(self):
+        url = 'imap://127.0.0.1:{}'.format(unused_port())
+        for path in [os.path.join(self.directory, 'outbox') + '/', os.path.join(self.directory, 'outbox.mbox')]:
+            drafts.write_outbox(path, make_messages(3))
+
+            stats = drafts.send_outbox(self.sender(url, workers=2), path)
+
+            self.assertEqual(stats.sent(), 0)
+            self.assertEqual(sorted(message['Subject'] for message in drafts.read_outbox(path)),
+                             ['Reminder 0', 'Reminder 1', 'Reminder 2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
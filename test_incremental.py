@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+import forecast
+from incremental import ForecastState
+from ledger import Ledger
+from test_aggregate import make_book
+
+
+MONTHS = [datetime(2020, 2, 6), datetime(2020, 3, 6), datetime(2020, 4, 6), datetime(2020, 5, 6)]
+
+BOOK = [
+    (datetime(2020, 1, 20), [('Dues', '-50.00'), ('Alice', '50.00')]),
+    (datetime(2020, 2, 20), [('Dues', '-50.00'), ('Bob', '50.00')]),
+    (datetime(2020, 3, 20), [('Dues', '-50.00'), ('Alice', '50.00')]),
+    (datetime(2020, 4, 20), [('Dues', '-50.00'), ('Bob', '50.00')]),
+]
+
+
+def edited(number, value):
+    # BOOK with one transaction's amount changed; it keeps its GUID and date
+    transactions = list(BOOK)
+    date, splits = transactions[number]
+    transactions[number] = (date, [(splits[0][0], '-' + value), (splits[1][0], value)])
+    return transactions
+
+
+class ForecastStateTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.filename = os.path.join(directory, 'state.pickle')
+
+    def run_forecast(self, state, transactions):
+        # What forecast.py does with the state: recompute the stale months, reuse the rest
+        book = make_book(transactions)
+        ledger = Ledger(book, forecast.MONTH_START_DAY)
+        stale = state.stale_months(ledger, MONTHS)
+        for month in stale:
+            state.update(ledger, month, {forecast.DUES: ledger.total(ledger.account('Dues'), month)})
+        state.save(book)
+        return stale
+
+    def test_edited_transaction_recomputes_its_period_and_later_ones(self):
+        self.assertEqual(self.run_forecast(ForecastState(self.filename, 'key'), BOOK), MONTHS)
+        # The period of the latest transaction can still get new ones, it is always recomputed
+        self.assertEqual(self.run_forecast(ForecastState(self.filename, 'key'), BOOK), MONTHS[3:])
+
+        state = ForecastState(self.filename, 'key')
+        self.assertEqual(self.run_forecast(state, edited(1, '75.00')), MONTHS[1:])
+        self.assertEqual(state.totals(MONTHS[1]), {forecast.DUES: -75})
+        self.assertEqual(state.totals(MONTHS[0]), {forecast.DUES: -50})
+
+        self.assertEqual(self.run_forecast(ForecastState(self.filename, 'key'), edited(0, '60.00')), MONTHS)
+        self.assertEqual(self.run_forecast(ForecastState(self.filename, 'key'), edited(0, '60.00')), MONTHS[3:])
+
+    def test_new_settings_reset_the_state(self):
+        self.run_forecast(forecast.open_state(self.filename), BOOK)
+        self.assertEqual(self.run_forecast(forecast.open_state(self.filename), BOOK), MONTHS[3:])
+
+        rules = dict(forecast.DEFAULT_ACCOUNT_RULES, rent=['Landlord', 'Storage'])
+        for state in [forecast.open_state(self.filename, compact=True),
+                      forecast.open_state(self.filename, rules=rules)]:
+            self.assertEqual(state.periods, {})
+            self.assertEqual(state.stale_months(Ledger(make_book(BOOK), forecast.MONTH_START_DAY), MONTHS), MONTHS)
+
+
+if __name__ == '__main__':
+    unittest.main()
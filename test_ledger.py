@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from test_aggregate import make_book, ledgers
+
+
+# Both ledgers are checked against the same hand-built book. Reporting
+# periods close at midnight on the 6th.
+
+JANUARY = datetime(2020, 1, 6)
+FEBRUARY = datetime(2020, 2, 6)
+MARCH = datetime(2020, 3, 6)
+APRIL = datetime(2020, 4, 6)
+
+BOOK = [
+    (datetime(2020, 1, 20), [('Dues', '-50.00'), ('Alice', '50.00')]),
+    # Exactly midnight on the closing day, the last moment of the period closing Feb 6th
+    (datetime(2020, 2, 6), [('Dues', '-50.50'), ('Bob', '50.50')]),
+    (datetime(2020, 2, 6, 0, 0, 1), [('Dues', '-50.00'), ('Alice', '50.00')]),
+    # Nothing in the period closing Apr 6th
+    (datetime(2020, 4, 10), [('Dues', '-25.00'), ('Bob', '25.00')]),
+]
+
+
+class LedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.book = make_book(BOOK)
+
+    def test_split_at_midnight_on_the_closing_day(self):
+        for ledger in ledgers(self.book):
+            dues = ledger.account('Dues')
+
+            self.assertEqual(ledger.total(dues, FEBRUARY), Decimal('-100.50'))
+            self.assertEqual(ledger.total(dues, MARCH), Decimal('-50.00'))
+            self.assertEqual([ledger.date(split) for split in ledger.splits(dues, FEBRUARY)],
+                             [datetime(2020, 1, 20), datetime(2020, 2, 6)])
+            self.assertEqual(ledger.period_end(datetime(2020, 2, 6)), FEBRUARY)
+            self.assertEqual(ledger.period_start(MARCH), FEBRUARY)
+
+    def test_empty_period(self):
+        for ledger in ledgers(self.book):
+            dues = ledger.account('Dues')
+
+            self.assertEqual(list(ledger.splits(dues, APRIL)), [])
+            self.assertEqual(ledger.total(dues, APRIL), 0)
+            self.assertEqual(ledger.total(dues, JANUARY), 0)
+            self.assertEqual(ledger.period_summary(APRIL), [])
+            self.assertEqual(ledger.balance(dues, APRIL), Decimal('-150.50'))
+
+    def test_balance_before_the_first_split(self):
+        for ledger in ledgers(self.book):
+            dues = ledger.account('Dues')
+            root = ledger.account('Root Account')
+
+            self.assertEqual(ledger.balance(dues, datetime(2020, 1, 19)), 0)
+            self.assertEqual(ledger.balance(dues, datetime(2020, 1, 20)), Decimal('-50.00'))
+            self.assertEqual(ledger.balance(dues, FEBRUARY), Decimal('-100.50'))
+            self.assertEqual(ledger.balance(ledger.account('Alice'), FEBRUARY, subtree=False), Decimal('50.00'))
+            self.assertEqual(ledger.balance(root, datetime(2020, 5, 1)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import unittest
+from datetime import datetime
+from periods import PeriodCalendar
+
+
+class PeriodCalendarTest(unittest.TestCase):
+    def setUp(self):
+        self.calendar = PeriodCalendar(6)
+
+    def test_midnight_on_the_closing_day_ends_the_period(self):
+        february = self.calendar.index(datetime(2020, 2, 6))
+
+        self.assertEqual(self.calendar.end(february), datetime(2020, 2, 6))
+        self.assertEqual(self.calendar.index(datetime(2020, 2, 5, 23, 59, 59)), february)
+        self.assertEqual(self.calendar.index(datetime(2020, 2, 6, 0, 0, 0, 1)), february + 1)
+        self.assertEqual(self.calendar.index(datetime(2020, 1, 6, 0, 0, 1)), february)
+
+    def test_closes(self):
+        self.assertEqual(self.calendar.closes(datetime(2019, 11, 20), datetime(2020, 2, 1)),
+                         [datetime(2019, 12, 6), datetime(2020, 1, 6), datetime(2020, 2, 6)])
+        self.assertEqual(self.calendar.closes(datetime(2020, 2, 1), datetime(2020, 2, 28)), [])
+
+    def test_short_months_close_on_their_last_day(self):
+        calendar = PeriodCalendar(31)
+
+        self.assertEqual(calendar.end(calendar.index(datetime(2020, 2, 15))), datetime(2020, 2, 29))
+        self.assertEqual(calendar.end(calendar.index(datetime(2021, 2, 28, 12))), datetime(2021, 3, 31))
+        self.assertEqual(calendar.end(calendar.index(datetime(2021, 4, 30))), datetime(2021, 4, 30))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import unittest
+from decimal import Decimal
+import projection
+
+
+MEMBERS = [50, 53, 51, 53, 47, 49]
+
+
+class ProjectionTest(unittest.TestCase):
+    def test_integer_series_are_not_floor_divided(self):
+        self.assertEqual(projection.fit('mean', MEMBERS).forecast(), Decimal('50.5'))
+        self.assertEqual(projection.fit('rolling:2', MEMBERS).forecast(), Decimal('48'))
+        self.assertEqual(projection.fit('rolling:4', MEMBERS).forecast(), Decimal('50'))
+        self.assertEqual(projection.fit('rolling:3', [1, 2, 2]).forecast(), Decimal(5) / 3)
+        self.assertEqual(projection.fit('seasonal', MEMBERS).forecast(), Decimal('50.5'))
+        self.assertEqual(projection.fit('trend', [1, 2]).forecast(), Decimal(3))
+        self.assertEqual(projection.fit('trend', [1, 2, 4, 5]).forecast(), Decimal('6.5'))
+
+    def test_decimal_mean_keeps_amounts_exact(self):
+        self.assertEqual(str(projection.fit('mean', [Decimal('10.10'), Decimal('20.20')]).forecast()), '15.15')
+
+    def test_last(self):
+        self.assertEqual(projection.fit('last', MEMBERS).forecast(3), 49)
+
+
+if __name__ == '__main__':
+    unittest.main()